@@ -1,20 +1,35 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session, g
+from flask import Flask, request, jsonify, render_template, redirect, url_for, session, g, make_response, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import is_resource_modified
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from flask_caching import Cache
-from flask_cors import CORS
 from file_storage import FileStorage
+from sqlite_storage import SQLiteStorage
+from stores import ban_store, api_key_store, blacklist_view, change_feed, pending_queue, RATE_LIMIT_STORAGE, RATE_LIMIT_FILES, RATE_LIMIT_STRATEGY
+import expiry_sweeper
+from api_key_store import RATE_LIMIT_TIERS, key_tier
+from change_feed import CHANGE_FEED_PAGE_SIZE
+from ban_store import BLOOM_FP_RATE
+from ban_views import batch_cost, format_ban, validate_batch, check_batch, ban_entry, search_results, validate_expiry
+from search_index import SEARCH_PAGE_SIZE
+from ban_transfer import read_import, export_ndjson, export_csv
+from compression import COMPRESSION_MIN_SIZE, compress, compress_stream, compressible, negotiate
+import fast_json
+from pending_queue import STATUSES
 from limits.storage import registry
-import json
 from datetime import datetime
-import requests
 from functools import wraps
 import os
 from dotenv import load_dotenv
 import uuid
+import time
+import random
+import logging
+import metrics
 
-# Register the custom storage with the limits library
+# Register the custom storages with the limits library
 registry.register_storage(FileStorage, "file")
+registry.register_storage(SQLiteStorage, "sqlite")
 
 # Discord OAuth2 settings
 load_dotenv()
@@ -22,49 +37,135 @@ CLIENT_ID = os.getenv('CLIENT_ID')
 CLIENT_SECRET = os.getenv('CLIENT_SECRET')
 REDIRECT_URI = 'http://localhost:5000/callback'
 
+class FastJSONProvider(DefaultJSONProvider):
+    # jsonify() and request.get_json() through fast_json (orjson when installed).
+    # Flask's fallbacks for dates, UUIDs and dataclasses still apply.
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return fast_json.dumps(obj, default=self.default, sort_keys=self.sort_keys).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return fast_json.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = fast_json.dumps(obj, default=self.default, sort_keys=self.sort_keys)
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+# Routes are registered on this module-level app; create_app() attaches the
+# extensions and storage, so importing this module stays cheap
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
+app.json = FastJSONProvider(app)
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
-CORS(app, supports_credentials=True)
 
-# Caching to reduce load on server
-cache = Cache(app, config={'CACHE_TYPE': 'simple'})
+# Caching to reduce load on server. The SQLite backend is shared by all workers
+# and supports tag invalidation; CACHE_TYPE=simple falls back to per-process caches.
+CACHE_CONFIG = {
+    'CACHE_TYPE': os.getenv('CACHE_TYPE', 'sqlite_cache.SQLiteCache'),
+    'CACHE_SQLITE_PATH': 'data/cache/cache.db',
+    'CACHE_THRESHOLD': int(os.getenv('CACHE_THRESHOLD', 10000))
+}
+cache = None  # flask_caching.Cache, set by create_app()
+
+def invalidate_cache(*tags):
+    # Drops cached entries tagged with any of `tags` in every worker
+    backend = cache.cache
+    if hasattr(backend, "invalidate_tags"):
+        backend.invalidate_tags(*tags)
+    else:
+        backend.clear()
+
+def shared_cache():
+    # The backend, when it can tag entries for invalidate_cache
+    return cache.cache if hasattr(cache.cache, "invalidate_tags") else None
+
+# Init Limiter with one of the registered storages (RATE_LIMIT_STORAGE, see stores.py)
+def request_identity():
+    # KeyIdentity for the request's X-API-Key, looked up once per request
+    if "identity" not in g:
+        g.identity = api_key_store.identify(request.headers.get("X-API-Key"))
+    return g.identity
+
+def rate_limit_key():
+    # Each valid key gets its own bucket, so servers sharing a NAT don't share a
+    # quota; requests without a valid key are limited per address
+    identity = request_identity()
+    return f"key:{identity.key_id}" if identity else get_remote_address()
+
+def tier_limits():
+    identity = request_identity()
+    return RATE_LIMIT_TIERS[identity.tier if identity else "default"]
 
-# Init Limiter with the registered file storage
+# Storage is only opened when create_app() calls limiter.init_app
 limiter = Limiter(
-    get_remote_address,
-    app=app,
-    default_limits=["200 per day", "50 per hour"],
-    storage_uri="file://",  # Now properly registered
+    rate_limit_key,
+    default_limits=[tier_limits],
+    storage_uri=f"{RATE_LIMIT_STORAGE}://",
     storage_options={
-        "file_path": "data/rate_limits/limiter.json"
-    }
+        "file_path": RATE_LIMIT_FILES[RATE_LIMIT_STORAGE]
+    },
+    strategy=RATE_LIMIT_STRATEGY
 )
+# Request timing for /metrics
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        metrics.observe("http_request_duration_seconds", time.perf_counter() - started, app="flask",
+                        route=request.url_rule.rule if request.url_rule else "unmatched",
+                        method=request.method, status=response.status_code)
+    return response
+
+@app.after_request
+def compress_response(response):
+    # Everything else compressible is compressed per response, streams included;
+    # the view_blacklist pages come pre-compressed from conditional_response
+    if (response.status_code < 200 or response.status_code in (204, 304) or request.method == "HEAD"
+            or response.direct_passthrough or "Content-Encoding" in response.headers
+            or not compressible(response.mimetype)):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.iter_encoded(), encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESSION_MIN_SIZE:
+            return response
+        response.set_data(compress(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+# Fraction of hot-path lookups that get logged; messages are only formatted when emitted
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1.0))
+
+def log_sampled(message, *args):
+    if app.logger.isEnabledFor(logging.INFO) and (LOG_SAMPLE_RATE >= 1 or random.random() < LOG_SAMPLE_RATE):
+        app.logger.info(message, *args)
+
 # Blacklist data
-BANNED_USERS_FILE = "data/banned_users.json"
-API_KEYS_FILE = "data/api_keys.json"
 AUTHORIZED_USERS = [987323487343493191, 1088268266499231764, 726721909374320640, 710863981039845467, 1151136371164065904]
 UNLIMITED_KEY_ROLES = [1201518458739892334]
-PENDING_REQUESTS = []
 
 def load_banned_users():
-    try:
-        with open(BANNED_USERS_FILE, "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
-
-def save_banned_users(banned_users):
-    with open(BANNED_USERS_FILE, "w") as f:
-        json.dump(banned_users, f, indent=4)
+    return ban_store.snapshot()
 
 def get_uuid(username):
-    url = f'https://api.mojang.com/users/profiles/minecraft/{username}'
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        return data.get('id')
-    return None
+    import mojang  # Deferred: pulls in requests, only needed for usernames without a UUID
+    return mojang.get_uuid(username)
 
 # Authentication Decorator
 def login_required(f):
@@ -85,43 +186,16 @@ def authorized_required(f):
     return decorated_function
 
 # API Key Functions
-def load_api_keys():
-    try:
-        with open(API_KEYS_FILE, "r") as f:
-            data = json.load(f)
-            return data.get("keys", [])
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        app.logger.warning(f"Error loading API keys: {str(e)}")
-        return []
-
-def save_api_keys(keys):  # Changed 'data' to 'keys' for clarity
-    with open(API_KEYS_FILE, "w") as f:
-        json.dump({"keys": keys}, f, indent=4)  # Ensure proper structure
-
 def get_user_id_from_api_key(api_key):
-    keys = load_api_keys()
-    now = datetime.utcnow()
-    for key_data in keys:
-        if key_data["key"] == api_key:
-            expiry_str = key_data.get("expiry")
-            if expiry_str is None:
-                return key_data["user_id"]
-            try:
-                expiry = datetime.fromisoformat(expiry_str)
-                if expiry > now:
-                    return key_data["user_id"]
-            except ValueError:
-                app.logger.error(f"Invalid expiry format in API key: {expiry_str}")
-    return None
+    return api_key_store.lookup(api_key)
 
 def api_key_required(f):
     @wraps(f)  # Preserve the original function's identity
     def decorated_function(*args, **kwargs):
-        api_key = request.headers.get("X-API-Key")
-        user_id = get_user_id_from_api_key(api_key)
-        if user_id is None:
+        identity = request_identity()
+        if identity is None:
             return jsonify({"error": "Invalid or missing API key"}), 401
-        g.user_id = user_id
+        g.user_id = identity.user_id
         return f(*args, **kwargs)
     return decorated_function
 
@@ -150,6 +224,7 @@ def callback():
         'code': code,
         'redirect_uri': REDIRECT_URI
     }
+    import requests  # Deferred: only the OAuth callback talks to Discord from the Flask app
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}
     response = requests.post(token_url, data=data, headers=headers)
     token_json = response.json()
@@ -175,30 +250,29 @@ def create_api_key():
         data = request.json or {}
         user_id = data.get("user_id")
         roles = data.get("roles", [])  # Get the roles array from the request
+        tier = data.get("tier")  # Optional rate-limit tier, settable by authorized users only
         
         # Validation
         if not user_id:
             return jsonify({"error": "Missing user_id parameter"}), 400
+        if tier is not None and (tier not in RATE_LIMIT_TIERS or str(g.user_id) not in map(str, AUTHORIZED_USERS)):
+            return jsonify({"error": f"tier must be one of {', '.join(RATE_LIMIT_TIERS)} and needs an authorized key"}), 400
             
-        keys = load_api_keys()
-        
-        # Check if user already has a key and if they're allowed multiple keys
+        # Users without an unlimited role get one key; add_key checks that
+        # under the store's write lock, so another worker's new key counts
         has_unlimited_role = any(role_id in UNLIMITED_KEY_ROLES for role_id in roles)
-        user_has_key = any(key_data["user_id"] == user_id for key_data in keys)
-        
-        if user_has_key and not has_unlimited_role:
-            return jsonify({"error": "User already has an API key"}), 400
-                
+
         new_key = str(uuid.uuid4())
-        keys.append({
+        key_data = {
             "key": new_key,
             "user_id": user_id,
             "created_at": datetime.utcnow().isoformat(),
             "role_created": True if has_unlimited_role else False,  # Track if created by privileged role
             "expiry": None
-        })
-        
-        save_api_keys(keys)
+        }
+        key_data["tier"] = tier or key_tier(key_data)
+        if not api_key_store.add_key(key_data, unique_user=not has_unlimited_role):
+            return jsonify({"error": "User already has an API key"}), 400
         app.logger.info(f"Created new API key for user: {user_id}")
         return jsonify({"api_key": new_key})
     except Exception as e:
@@ -210,19 +284,16 @@ def create_api_key():
 @api_authorized_required
 def get_user_api_keys(user_id):
     try:
-        # Load all API keys
-        keys = load_api_keys()
-        
-        # Filter keys for the specific user
         user_keys = [
             {
-                "key": key_data["key"],
-                "created_at": key_data["created_at"],
+                # Only the digest is stored; the prefix lets users tell their keys apart
+                "prefix": key_data.get("prefix"),
+                "created_at": key_data.get("created_at"),
                 "role_created": key_data.get("role_created", False),
-                "expiry": key_data.get("expiry")
+                "expiry": key_data.get("expiry"),
+                "tier": key_tier(key_data)
             }
-            for key_data in keys
-            if key_data["user_id"] == user_id
+            for key_data in api_key_store.keys_for_user(user_id)
         ]
         
         if not user_keys:
@@ -252,20 +323,18 @@ def blacklist_user():
         reason = data['reason']
         display_name = data['display_name']
         mc_info = data.get('mc_info', {})
+        # Optional end of a time-limited ban
+        expires_at, error = validate_expiry(data.get('expires_at'))
+        if error:
+            return jsonify({"error": error}), 400
         if 'minecraft_username' in mc_info and 'minecraft_uuid' not in mc_info:
             mc_info['minecraft_uuid'] = get_uuid(mc_info['minecraft_username'])
             app.logger.info(mc_info)
             if not mc_info['minecraft_uuid']:
                 app.logger.error(f"Invalid Minecraft username: {mc_info['minecraft_username']}")
                 return jsonify({"error": "Invalid Minecraft username"}), 400
-        banned_users = load_banned_users()
-        banned_users[user_id] = {
-            "reason": reason,
-            "timestamp": datetime.utcnow().isoformat(),
-            "display_name": display_name,
-            "mc_info": mc_info
-        }
-        save_banned_users(banned_users)
+        ban_store.ban(user_id, ban_entry(reason, display_name, mc_info, expires_at))
+        invalidate_cache("blacklist")
         app.logger.info(f"Successfully blacklisted user {user_id}")
         return jsonify({"message": "User blacklisted successfully"})
     except Exception as e:
@@ -290,21 +359,12 @@ def remove_from_blacklist():
         if field not in ['user_id', 'minecraft_uuid']:
             return jsonify({"error": "Invalid field. Must be 'user_id' or 'minecraft_uuid'"}), 400
 
-        banned_users = load_banned_users()
-        
-        # Search for the user to remove
-        user_to_remove = None
-        for user_id, details in banned_users.items():
-            if field == 'user_id' and user_id == identifier:
-                user_to_remove = user_id
-                break
-            elif field == 'minecraft_uuid' and details.get('mc_info', {}).get('minecraft_uuid') == identifier:
-                user_to_remove = user_id
-                break
+        # Look the user up through the store's indexes
+        user_to_remove = ban_store.find_by(field, identifier)
         
         if user_to_remove:
-            del banned_users[user_to_remove]
-            save_banned_users(banned_users)
+            ban_store.unban(user_to_remove)
+            invalidate_cache("blacklist")
             app.logger.info(f"User with {field}={identifier} removed from blacklist")
             return jsonify({"message": f"User with {field}={identifier} removed from blacklist"})
         else:
@@ -318,34 +378,115 @@ def remove_from_blacklist():
 @app.route('/check_blacklist/<identifier>', methods=['GET'])
 @api_key_required
 def check_blacklist(identifier):
-    banned_users = load_banned_users()
-    app.logger.info(f"Checking blacklist for identifier: {identifier}")
-    for user_id, details in banned_users.items():
-        mc_info = details.get('mc_info', {})
-        if user_id == identifier or mc_info.get('minecraft_uuid') == identifier or mc_info.get('uuid') == identifier:
-            # Format the timestamp
-            timestamp = details.get("timestamp")
-            formatted_timestamp = timestamp
-            if timestamp:
-                try:
-                    # Parse the ISO timestamp and format it
-                    dt = datetime.fromisoformat(timestamp)
-                    formatted_timestamp = dt.strftime("%B %d, %Y at %I:%M %p")
-                except (ValueError, TypeError):
-                    # If parsing fails, use the original timestamp
-                    pass
-                    
-            result = {
-                "reason": details["reason"],
-                "display_name": details.get("display_name", "Unknown"),
-                "timestamp": formatted_timestamp,
-                "mc_info": mc_info
-            }
-            app.logger.info(f"Found match for identifier: {identifier}, Details: {result}")
-            return jsonify(result)
-    app.logger.info(f"No match found for identifier: {identifier}")
+    log_sampled("Checking blacklist for identifier: %s", identifier)
+    # Served from the mmap'd ban index, or the Bloom filter and in-memory indexes
+    match = ban_store.lookup(identifier)
+    if match is not None:
+        result = format_ban(match[1])
+        log_sampled("Found match for identifier: %s, Details: %s", identifier, result)
+        return jsonify(result)
+    log_sampled("No match found for identifier: %s", identifier)
     return jsonify({})
 
+@app.route('/blacklist/bloom', methods=['GET'])
+@api_key_required
+def blacklist_bloom():
+    # Serialized filter for local pre-checks; the layout is documented in bloom.py
+    etag = ban_store.version
+    if not is_resource_modified(request.environ, etag=etag):
+        response = make_response("", 304)
+    else:
+        response = Response(ban_store.bloom_filter().to_bytes(), mimetype='application/octet-stream')
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route('/blacklist/bloom/stats', methods=['GET'])
+@api_key_required
+def blacklist_bloom_stats():
+    stats = ban_store.bloom_filter().stats()
+    stats["configured_fp_rate"] = BLOOM_FP_RATE
+    stats["version"] = ban_store.version
+    return jsonify(stats)
+
+@app.route('/check_blacklist/batch', methods=['POST'])
+@api_key_required
+@limiter.limit(tier_limits, cost=lambda: batch_cost(request.get_json(silent=True)))
+def check_blacklist_batch():
+    identifiers, error = validate_batch(request.get_json(silent=True) or {})
+    if error:
+        return jsonify({"error": error}), 400
+    results = check_batch(ban_store, identifiers)
+    log_sampled("Batch blacklist check: %d identifiers", len(results))
+    return jsonify({"results": results})
+
+@app.route('/blacklist/import', methods=['POST'])
+@api_key_required
+@api_authorized_required
+def import_blacklist():
+    # Body: JSON Lines (default) or CSV with ?format=csv / Content-Type: text/csv.
+    # Rows are validated while streaming, usernames are resolved through Mojang's
+    # bulk endpoint, and every valid row is banned in one write.
+    fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({"error": "format must be 'ndjson' or 'csv'"}), 400
+    import mojang
+    try:
+        entries, errors, error_count, retryable_count = read_import(request.stream, fmt, mojang.get_uuids)
+    except UnicodeDecodeError:
+        return jsonify({"error": "Body must be UTF-8"}), 400
+    ban_store.ban_many(entries)
+    if entries:
+        invalidate_cache("blacklist")
+    app.logger.info(f"Imported {len(entries)} bans ({error_count} rows rejected, {retryable_count} retryable)")
+    # "retryable" rows failed only because Mojang couldn't be reached; sending them again may succeed
+    return jsonify({"imported": len(entries), "rejected": error_count, "retryable": retryable_count,
+                    "errors": errors})
+
+@app.route('/blacklist/export', methods=['GET'])
+@api_key_required
+@limiter.limit("10 per hour")
+def export_blacklist():
+    # Streams the list entry by entry, in the format /blacklist/import accepts
+    if request.args.get('format', 'ndjson') == 'csv':
+        body, mimetype, extension = export_csv(ban_store.iter_bans()), 'text/csv', 'csv'
+    else:
+        body, mimetype, extension = export_ndjson(ban_store.iter_bans()), 'application/x-ndjson', 'jsonl'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=blacklist.{extension}'})
+
+@app.route('/blacklist/search', methods=['GET'])
+@api_key_required
+def search_blacklist():
+    # Ranked prefix/substring search over usernames, display names and reasons
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Missing search query: q"}), 400
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', SEARCH_PAGE_SIZE, type=int)
+    return jsonify(search_results(ban_store, query, page, per_page))
+
+# Polled by mirrors. The push version, /blacklist/changes/stream, is only
+# served by the ASGI app (asgi.py): here each open stream would hold a sync
+# worker for as long as the client stays connected.
+@app.route('/blacklist/changes', methods=['GET'])
+@api_key_required
+def blacklist_changes():
+    since = request.args.get('since', 0, type=int)
+    limit = min(request.args.get('limit', CHANGE_FEED_PAGE_SIZE, type=int), CHANGE_FEED_PAGE_SIZE)
+    changes, latest, reset = change_feed.since(since, limit)
+    return jsonify({
+        "version": latest,
+        "changes": changes,
+        "reset": reset,
+        "more": bool(changes) and changes[-1]["seq"] < latest
+    })
+
+@app.route('/metrics')
+@limiter.exempt
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # Web Routes
 @app.route('/')
 def index():
@@ -371,50 +512,108 @@ def website_blacklist():
         'minecraft_uuid': minecraft_uuid,
         'reason': reason
     }
-    PENDING_REQUESTS.append(request_data)
-    return jsonify({"message": "Request submitted successfully"})
+    request_id = pending_queue.submit(request_data)
+    return jsonify({"message": "Request submitted successfully", "request_id": request_id})
+
+def conditional_response(etag, build, mimetype):
+    # Answers 304 when the client already has this version, otherwise builds the
+    # body: build(encoding) returns (body, encoding applied or None). Each
+    # encoding is a different representation, so it gets its own ETag.
+    encoding = negotiate(request.headers.get("Accept-Encoding"))
+    if encoding:
+        etag = f"{etag}-{encoding}"
+    last_modified = blacklist_view.last_modified
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response("", 304)
+    else:
+        body, applied = build(encoding)
+        response = Response(body, mimetype=mimetype)
+        if applied:
+            response.headers["Content-Encoding"] = applied
+    response.vary.add("Accept-Encoding")
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 @app.route('/view_blacklist')
-@cache.cached(timeout=300)
 @limiter.limit("100 per hour")
 def view_blacklist():
-    banned_users = load_banned_users()
-    # Format the data for easier template rendering
-    formatted_users = []
-    for user_id, details in banned_users.items():
-        timestamp = details.get("timestamp", "")
-        formatted_timestamp = timestamp
-        if timestamp:
-            try:
-                dt = datetime.fromisoformat(timestamp)
-                formatted_timestamp = dt.strftime("%B %d, %Y at %I:%M %p")
-            except (ValueError, TypeError):
-                pass
-        
-        formatted_users.append({
-            "user_id": user_id,
-            "display_name": details.get("display_name", "Unknown"),
-            "reason": details.get("reason", ""),
-            "timestamp": formatted_timestamp,
-            "minecraft_username": details.get("mc_info", {}).get("minecraft_username", ""),
-            "minecraft_uuid": details.get("mc_info", {}).get("minecraft_uuid", "")
-        })
-    
-    return render_template('blacklisted.html',
-                         banned_users=formatted_users,
-                         discord_id=session.get("discord_id"),
-                         discord_username=session.get("discord_username"))
+    discord_id = session.get("discord_id")
+    discord_username = session.get("discord_username")
+    etag = blacklist_view.etag(discord_id, discord_username)
+
+    def build(encoding):
+        return blacklist_view.render((discord_id, discord_username), lambda rows: render_template(
+            'blacklisted.html',
+            banned_users=rows,
+            discord_id=discord_id,
+            discord_username=discord_username), cache=shared_cache(), encoding=encoding)
+
+    response = conditional_response(etag, build, 'text/html')
+    response.vary.add("Cookie")
+    return response
+
+@app.route('/view_blacklist/json')
+@limiter.limit("100 per hour")
+def view_blacklist_json():
+    query = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 50, type=int)
+    etag = blacklist_view.etag(query, page, per_page)
+    build = lambda encoding: blacklist_view.render(
+        ("json", query, page, per_page), lambda rows: fast_json.dumps(blacklist_view.page(query, page, per_page)),
+        cache=shared_cache(), encoding=encoding)
+    return conditional_response(etag, build, 'application/json')
 
 @app.route('/blacklist_requests')
 @login_required
 @authorized_required
 def blacklist_requests():
+    status = request.args.get('status', 'pending')
+    if status not in STATUSES:
+        return jsonify({"error": f"Invalid status. Must be one of: {', '.join(STATUSES)}"}), 400
+    listing = pending_queue.list(status,
+                                 request.args.get('page', 1, type=int),
+                                 request.args.get('per_page', 50, type=int))
     return jsonify({
-        "requests": PENDING_REQUESTS,
+        **listing,
         "discord_id": session.get("discord_id"),
         "discord_username": session.get("discord_username")
     })
 
+@app.route('/blacklist_requests/<int:request_id>/approve', methods=['POST'])
+@login_required
+@authorized_required
+def approve_blacklist_request(request_id):
+    pending = pending_queue.get(request_id)
+    if pending is None:
+        return jsonify({"error": "Request not found"}), 404
+    if pending["status"] != "pending":
+        return jsonify({"error": f"Request already {pending['status']}"}), 409
+    mc_info = {}
+    if pending["minecraft_username"]:
+        mc_info["minecraft_username"] = pending["minecraft_username"]
+    if pending["minecraft_uuid"]:
+        mc_info["minecraft_uuid"] = pending["minecraft_uuid"]
+    # Ban first: if two moderators approve at once the ban is simply written twice
+    ban_store.ban(pending["discord_user_id"], ban_entry(pending["reason"], pending["display_name"], mc_info))
+    invalidate_cache("blacklist")
+    pending_queue.resolve(request_id, "approved", session.get("discord_id"))
+    app.logger.info(f"Request {request_id} approved by {session.get('discord_id')}")
+    return jsonify({"message": "Request approved and user blacklisted"})
+
+@app.route('/blacklist_requests/<int:request_id>/reject', methods=['POST'])
+@login_required
+@authorized_required
+def reject_blacklist_request(request_id):
+    if pending_queue.get(request_id) is None:
+        return jsonify({"error": "Request not found"}), 404
+    if not pending_queue.resolve(request_id, "rejected", session.get("discord_id")):
+        return jsonify({"error": "Request already handled"}), 409
+    app.logger.info(f"Request {request_id} rejected by {session.get('discord_id')}")
+    return jsonify({"message": "Request rejected"})
+
 @app.route('/check_login')
 def check_login():
     if session.get("discord_id"):
@@ -422,6 +621,47 @@ def check_login():
     else:
         return jsonify({"logged_in": False})
 
+def create_app():
+    # WSGI entry point (see wsgi.py). Configures the module-level app once, so
+    # calling it again (tests, the preloading gunicorn master) is cheap.
+    global cache
+    if cache is not None:
+        return app
+    from flask_caching import Cache
+    from flask_cors import CORS
+
+    # Stable across workers when gunicorn preloads the app, so sessions survive
+    # a request landing on another worker
+    app.secret_key = os.getenv('SECRET_KEY') or os.urandom(24)
+    CORS(app, supports_credentials=True)
+    cache = Cache(app, config=CACHE_CONFIG)
+    # RATELIMIT_ENABLED=0 turns limiting off, e.g. for load tests
+    app.config["RATELIMIT_ENABLED"] = os.getenv("RATELIMIT_ENABLED", "1") != "0"
+    # X-RateLimit-Limit/-Remaining/-Reset and Retry-After, so clients can pace themselves
+    app.config["RATELIMIT_HEADERS_ENABLED"] = True
+    limiter.init_app(app)
+    return app
+
+def warm_up():
+    # Loads the read-mostly data in the gunicorn master when preloading, so the
+    # workers share it copy-on-write instead of each parsing it again. Only file
+    # backed stores load here: SQLite connections must not cross a fork. Bans
+    # served from the mmap index aren't loaded at all; the index is built here.
+    if not ban_store.ensure_index():
+        ban_store.refresh()
+    api_key_store.refresh(force=True)
+
+def sweeper_removed(expired):
+    # Responses cached before the expiry sweep still show what it removed
+    if expired["ban"]:
+        invalidate_cache("blacklist")
+
+def start_sweeper():
+    # Per worker, after create_app() (see gunicorn.conf.py)
+    return expiry_sweeper.start(on_sweep=sweeper_removed)
+
 if __name__ == '__main__':
     os.makedirs("data", exist_ok=True)
+    create_app()
+    start_sweeper()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,279 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+import metrics
+from storage_utils import atomic_write_json, file_lock, file_signature
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on how long a revoked or edited key keeps its old answer in a worker
+API_KEY_CACHE_TTL = float(os.getenv("API_KEY_CACHE_TTL", 5))
+API_KEY_CACHE_SIZE = int(os.getenv("API_KEY_CACHE_SIZE", 10000))
+API_KEY_SALT_FILE = os.getenv("API_KEY_SALT_FILE", "data/api_key_salt")
+KEY_PREFIX_LENGTH = 8
+# Request quotas per key tier, in flask_limiter/limits notation. A key record's
+# optional "tier" picks one; keys created by an UNLIMITED_KEY_ROLES holder
+# (role_created) default to "role", everything else (and no key) to "default".
+RATE_LIMIT_TIERS = {
+    "default": os.getenv("RATE_LIMIT_DEFAULT", "200 per day;50 per hour"),
+    "role": os.getenv("RATE_LIMIT_ROLE", "5000 per day;1000 per hour"),
+    "unlimited": os.getenv("RATE_LIMIT_UNLIMITED", "1000000 per day;100000 per hour"),
+}
+_MISSING = object()
+
+# Who a valid key belongs to. key_id is a digest prefix: stable per key and safe
+# to use as a rate-limit bucket name, unlike the key itself.
+KeyIdentity = namedtuple("KeyIdentity", ["user_id", "tier", "key_id"])
+
+
+def key_tier(key_data):
+    tier = key_data.get("tier") or ("role" if key_data.get("role_created") else "default")
+    return tier if tier in RATE_LIMIT_TIERS else "default"
+
+
+def _load_salt():
+    # The server secret keys are hashed with. Losing it invalidates every stored
+    # key, so it lives in API_KEY_SALT or in a file created once, never rotated.
+    salt = os.getenv("API_KEY_SALT")
+    if salt:
+        return salt.encode()
+    if not os.path.exists(API_KEY_SALT_FILE):
+        # Written in full to a temp file and linked into place, so the salt
+        # file never exists empty or half-written for another worker to read
+        directory = os.path.dirname(API_KEY_SALT_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory or ".", prefix=".salt-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+                f.flush()
+                os.fsync(f.fileno())
+            os.link(temp_path, API_KEY_SALT_FILE)
+        except FileExistsError:
+            # Created first by another worker (or an earlier run)
+            pass
+        finally:
+            os.unlink(temp_path)
+    with open(API_KEY_SALT_FILE) as f:
+        salt = f.read().strip()
+    if not salt:
+        raise RuntimeError(f"{API_KEY_SALT_FILE} is empty; restore it or set API_KEY_SALT")
+    return salt.encode()
+
+
+_salt = None
+
+
+def key_digest(api_key):
+    # Keyed hash: a leaked api_keys.json can't be checked against guessed keys
+    global _salt
+    if _salt is None:
+        _salt = _load_salt()
+    return hmac.new(_salt, api_key.encode(), hashlib.sha256).hexdigest()
+
+
+def hash_record(key_data):
+    # Stored form of a key record: the raw key is replaced by its digest and a
+    # short prefix users can recognise their keys by. Hashed records pass through.
+    if "key" not in key_data:
+        return dict(key_data)
+    record = {name: value for name, value in key_data.items() if name != "key"}
+    record["key_hash"] = key_digest(key_data["key"])
+    record["prefix"] = key_data["key"][:KEY_PREFIX_LENGTH]
+    return record
+
+
+def parse_expiry(expiry_str):
+    # Stored expiries are naive UTC isoformat strings (datetime.utcnow().isoformat())
+    if expiry_str is None:
+        return None
+    expiry = datetime.fromisoformat(expiry_str)
+    if expiry.tzinfo is None:
+        expiry = expiry.replace(tzinfo=timezone.utc)
+    return expiry.timestamp()
+
+
+class ApiKeyStore:
+    # api_keys.json holds {"keys": {key digest: record}}: keys are stored only
+    # as salted digests (key_digest), and records carry a display prefix instead.
+    # In memory there is an index on the digest, verified with a constant-time
+    # compare, and one on user_id, so validation is O(1) and listing a user's
+    # keys is O(their keys). Files in the old plaintext list format still load
+    # (hashed in memory) and are rewritten hashed by migrate() or the next write.
+    #
+    # Validation results (including unknown keys) are cached for at most `ttl`
+    # seconds and never past the key's own expiry. The file is stat'ed at most
+    # once per `ttl`, so revocations made by another worker take effect within
+    # that window.
+
+    def __init__(self, file_path, ttl=API_KEY_CACHE_TTL, maxsize=API_KEY_CACHE_SIZE):
+        self.file_path = file_path
+        self.lock_path = f"{file_path}.lock"
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._signature = None
+        self._checked_at = 0.0
+        self._records = {}
+        self._index = {}
+        self._by_user = {}
+        self._next_expiry = None
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def _load(self):
+        # {digest: record}, whichever format the file is in
+        try:
+            with open(self.file_path, "r") as f:
+                keys = json.load(f).get("keys", {})
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            logger.warning(f"Error loading API keys: {str(e)}")
+            return {}
+        if isinstance(keys, list):
+            keys = {record.pop("key_hash"): record for record in map(hash_record, keys)}
+        return keys
+
+    def _rebuild(self, keys):
+        index = {}
+        by_user = {}
+        next_expiry = None
+        for digest, key_data in keys.items():
+            try:
+                expires_at = parse_expiry(key_data.get("expiry"))
+            except ValueError:
+                logger.error(f"Invalid expiry format in API key: {key_data.get('expiry')}")
+                continue
+            if expires_at is not None and (next_expiry is None or expires_at < next_expiry):
+                next_expiry = expires_at
+            # Looked up by the key_id prefix; the full digest is compared in constant time
+            index[digest[:16]] = (digest, key_data["user_id"], expires_at, key_tier(key_data))
+            by_user.setdefault(str(key_data["user_id"]), []).append(digest)
+        self._records = keys
+        self._index = index
+        self._by_user = by_user
+        self._next_expiry = next_expiry
+        self._cache.clear()
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.ttl:
+            return
+        with self._lock:
+            self._checked_at = now
+            signature = file_signature(self.file_path)
+            if force or signature != self._signature:
+                with metrics.timer("json_io_seconds", file="api_keys", op="load"):
+                    self._rebuild(self._load())
+                self._signature = signature
+
+    def invalidate(self):
+        # Call after writing the file from this process so the change is seen immediately
+        self.refresh(force=True)
+
+    def identify(self, api_key):
+        # KeyIdentity for a valid, unexpired key, else None
+        if not api_key:
+            return None
+        self.refresh()
+        digest = key_digest(api_key)
+        identity = self._cache.get(digest, _MISSING)
+        metrics.cache_result("api_keys", identity is not _MISSING)
+        if identity is not _MISSING:
+            return identity
+        stored, user_id, expires_at, tier = self._index.get(digest[:16], ("", None, None, None))
+        if (user_id is None or not hmac.compare_digest(stored, digest)
+                or (expires_at is not None and expires_at <= time.time())):
+            self._cache.set(digest, None)
+            return None
+        identity = KeyIdentity(user_id, tier, digest[:16])
+        self._cache.set(digest, identity, expires_at=expires_at)
+        return identity
+
+    def lookup(self, api_key):
+        identity = self.identify(api_key)
+        return identity.user_id if identity else None
+
+    def all_keys(self):
+        # Hashed records, each with its key_hash
+        self.refresh(force=True)
+        return [dict(record, key_hash=digest) for digest, record in self._records.items()]
+
+    def keys_for_user(self, user_id):
+        self.refresh()
+        # _records and _by_user are replaced one after the other by a reload,
+        # which the expiry sweeper may run on another thread
+        with self._lock:
+            return [dict(self._records[digest], key_hash=digest) for digest in self._by_user.get(str(user_id), ())]
+
+    def add_keys(self, records, unique_user=False):
+        # Read-modify-write under the file lock, so concurrent workers don't drop
+        # each other's keys. Raw keys are hashed here and never written. With
+        # unique_user nothing is written (and False returned) if any of the
+        # users already has a key; checked under the lock, so a key another
+        # worker just created counts.
+        with file_lock(self.lock_path), metrics.timer("json_io_seconds", file="api_keys", op="save"):
+            keys = self._load()
+            if unique_user:
+                user_ids = {str(record["user_id"]) for record in records}
+                if any(str(key_data.get("user_id")) in user_ids for key_data in keys.values()):
+                    return False
+            for record in map(hash_record, records):
+                keys[record.pop("key_hash")] = record
+            atomic_write_json(self.file_path, {"keys": keys}, indent=4)
+        self.invalidate()
+        return True
+
+    def add_key(self, record, unique_user=False):
+        return self.add_keys([record], unique_user)
+
+    def next_expiry(self):
+        # When the first key with an expiry runs out, or None
+        self.refresh()
+        return self._next_expiry
+
+    def purge_expired(self, now=None):
+        # Drops expired keys from the file, so they are neither stored nor
+        # indexed any more. Keys with an unparseable expiry are left for
+        # someone to fix. Returns how many were dropped.
+        now = time.time() if now is None else now
+        next_expiry = self.next_expiry()
+        if next_expiry is None or next_expiry > now:
+            return 0
+        with file_lock(self.lock_path), metrics.timer("json_io_seconds", file="api_keys", op="purge"):
+            keys = self._load()
+            expired = []
+            for digest, key_data in keys.items():
+                try:
+                    expires_at = parse_expiry(key_data.get("expiry"))
+                except ValueError:
+                    continue
+                if expires_at is not None and expires_at <= now:
+                    expired.append(digest)
+            for digest in expired:
+                del keys[digest]
+            if expired:
+                atomic_write_json(self.file_path, {"keys": keys}, indent=4)
+        self.invalidate()
+        return len(expired)
+
+    def migrate(self):
+        # Rewrites a plaintext file in the hashed format; returns the number of keys
+        self.add_keys([])
+        return len(self._records)
+
+
+if __name__ == "__main__":
+    # One-off migration of plaintext keys: python api_key_store.py migrate [data/api_keys.json]
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        sys.exit("usage: python api_key_store.py migrate [api_keys.json]")
+    path = sys.argv[2] if len(sys.argv) > 2 else "data/api_keys.json"
+    print(f"Hashed {ApiKeyStore(path).migrate()} API keys in {path}")
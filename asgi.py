@@ -0,0 +1,398 @@
+import asyncio
+import functools
+import logging
+import time
+import metrics
+from email.utils import format_datetime, parsedate_to_datetime
+from urllib.parse import parse_qs, unquote
+import aiohttp
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from limits import parse_many
+from limits.storage import storage_from_string
+from limits.strategies import STRATEGIES
+import mojang
+import fast_json
+from compression import negotiate
+from change_feed import CHANGE_FEED_PAGE_SIZE, CHANGE_STREAM_POLL_SECONDS, CHANGE_STREAM_HEARTBEAT_SECONDS, sse_event, sse_reset
+from ban_views import batch_cost, format_ban, validate_batch, check_batch, search_results
+from sqlite_cache import SQLiteCache
+from stores import RATE_LIMIT_STORAGE, RATE_LIMIT_STRATEGY, ban_store, api_key_store, blacklist_view, change_feed, open_limiter_storage
+from api_key_store import RATE_LIMIT_TIERS
+from identifiers import MINECRAFT_USERNAME
+from search_index import SEARCH_PAGE_SIZE
+
+# ASGI entry point for the read-only blacklist endpoints. It shares the data
+# layer (stores.py, ban_views.py) with the Flask app, but every request is a
+# coroutine, so a slow Mojang call only parks that request instead of a whole
+# worker. Store, cache and limiter calls still do blocking file and SQLite I/O,
+# so they run on the loop's default thread pool (in_thread), never on the loop.
+#
+# One deliberate difference: check_blacklist here resolves a username with no
+# ban stored under it through Mojang, and then looks up the UUID. The Flask
+# route only matches stored identifiers, because a blocking Mojang call would
+# hold a sync worker. Run it under uvicorn workers, e.g.
+#
+#   GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn -c gunicorn.conf.py
+
+logger = logging.getLogger('IDoTheLogger')
+
+MAX_BODY_SIZE = 1024 * 1024
+_MISSING = object()
+
+# Same cache file as the Flask app, so rendered pages are shared between them
+shared_cache = SQLiteCache("data/cache/cache.db")
+templates = Environment(loader=FileSystemLoader("templates"), autoescape=select_autoescape())
+
+# Same per-tier limits, storage and strategy as the Flask app (RATE_LIMIT_STORAGE)
+rate_limiter = STRATEGIES[RATE_LIMIT_STRATEGY](open_limiter_storage() or storage_from_string(f"{RATE_LIMIT_STORAGE}://"))
+TIER_LIMITS = {tier: list(parse_many(limits)) for tier, limits in RATE_LIMIT_TIERS.items()}
+VIEW_LIMITS = list(parse_many("100 per hour"))
+
+
+async def in_thread(func, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+class Request:
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        self.query = parse_qs(scope.get("query_string", b"").decode())
+        self.remote_addr = (scope.get("client") or ("127.0.0.1", 0))[0]
+        self.response_headers = []  # Added to whatever response the handler sends
+        self._identity = _MISSING
+
+    @property
+    def identity(self):
+        # KeyIdentity for the X-API-Key header, looked up once per request
+        if self._identity is _MISSING:
+            self._identity = api_key_store.identify(self.headers.get("x-api-key"))
+        return self._identity
+
+    async def identify(self):
+        # identity, resolved off the loop (the key store may reload its file)
+        if self._identity is _MISSING:
+            self._identity = await in_thread(api_key_store.identify, self.headers.get("x-api-key"))
+        return self._identity
+
+    async def body(self):
+        chunks = []
+        size = 0
+        while True:
+            message = await self.receive()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > MAX_BODY_SIZE:
+                raise ValueError("Request body too large")
+            chunks.append(chunk)
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    async def json(self):
+        body = await self.body()
+        try:
+            return fast_json.loads(body or b"null")
+        except ValueError:
+            return None
+
+
+async def send_response(send, status, body, content_type="application/json", headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())]
+                   + [(name.encode(), value.encode()) for name, value in headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, payload, status=200):
+    await send_response(send, status, fast_json.dumps(payload))
+
+
+def rate_limited(request, route, limits=None, cost=1):
+    # Keyed and tiered like the Flask app (limits=None means the caller's tier),
+    # with the same quota headers for the tightest limit. Blocking: call it
+    # through in_thread.
+    identity = request.identity
+    key = f"key:{identity.key_id}" if identity else request.remote_addr
+    if limits is None:
+        limits = TIER_LIMITS[identity.tier if identity else "default"]
+    allowed = all(rate_limiter.hit(item, "asgi", route, key, cost=cost) for item in limits)
+    remaining, reset, limit = min(
+        (rate_limiter.get_window_stats(item, "asgi", route, key)[::-1] + (item,) for item in limits),
+        key=lambda stats: stats[0],
+    )
+    request.response_headers = [("x-ratelimit-limit", str(limit.amount)),
+                                ("x-ratelimit-remaining", str(max(remaining, 0))),
+                                ("x-ratelimit-reset", str(int(reset)))]
+    if not allowed:
+        request.response_headers.append(("retry-after", str(max(int(reset - time.time()), 1))))
+    return not allowed
+
+
+async def authenticate(request):
+    identity = await request.identify()
+    return identity.user_id if identity else None
+
+
+async def check_blacklist(app, request, send, identifier):
+    if await authenticate(request) is None:
+        return await send_json(send, {"error": "Invalid or missing API key"}, 401)
+    if await in_thread(rate_limited, request, "check_blacklist"):
+        return await send_json(send, {"error": "Rate limit exceeded"}, 429)
+    match = await in_thread(ban_store.lookup, identifier)
+    if match is None and MINECRAFT_USERNAME.match(identifier) and not identifier.isdigit():
+        # Usernames stored with a ban matched above; others resolve through Mojang
+        # on the shared session (unlike the Flask route, see above)
+        minecraft_uuid = await mojang.get_uuid_async(identifier, app.session)
+        if minecraft_uuid:
+            match = await in_thread(ban_store.lookup, minecraft_uuid)
+    if match is None:
+        return await send_json(send, {})
+    await send_json(send, format_ban(match[1]))
+
+
+async def check_blacklist_batch(app, request, send):
+    if await authenticate(request) is None:
+        return await send_json(send, {"error": "Invalid or missing API key"}, 401)
+    try:
+        data = await request.json()
+    except ValueError as e:
+        return await send_json(send, {"error": str(e)}, 413)
+    # Charged by size, so the body is read first
+    if await in_thread(rate_limited, request, "check_blacklist_batch", cost=batch_cost(data)):
+        return await send_json(send, {"error": "Rate limit exceeded"}, 429)
+    identifiers, error = validate_batch(data or {})
+    if error:
+        return await send_json(send, {"error": error}, 400)
+    await send_json(send, {"results": await in_thread(check_batch, ban_store, identifiers)})
+
+
+def not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return if_none_match.strip() == "*" or f'"{etag}"' in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def send_conditional(request, send, etag, build, content_type):
+    # build(encoding) -> (body, encoding applied or None), as in the Flask app
+    encoding = negotiate(request.headers.get("accept-encoding"))
+    if encoding:
+        etag = f"{etag}-{encoding}"
+    last_modified = await in_thread(lambda: blacklist_view.last_modified)
+    headers = [("etag", f'"{etag}"'), ("last-modified", format_datetime(last_modified, usegmt=True)),
+               ("cache-control", "no-cache"), ("vary", "Accept-Encoding")]
+    if not_modified(request, etag, last_modified):
+        return await send_response(send, 304, b"", content_type, headers)
+    body, applied = await in_thread(build, encoding)
+    if applied:
+        headers.append(("content-encoding", applied))
+    await send_response(send, 200, body.encode() if isinstance(body, str) else body, content_type, headers)
+
+
+async def view_blacklist(app, request, send):
+    if await in_thread(rate_limited, request, "view_blacklist", VIEW_LIMITS):
+        return await send_json(send, {"error": "Rate limit exceeded"}, 429)
+    # The Flask session cookie can't be read here, so the page renders logged out
+    etag = await in_thread(blacklist_view.etag, None, None)
+    build = lambda encoding: blacklist_view.render((None, None), lambda rows: templates.get_template("blacklisted.html").render(
+        banned_users=rows,
+        discord_id=None,
+        discord_username=None,
+    ), cache=shared_cache, encoding=encoding)
+    await send_conditional(request, send, etag, build, "text/html; charset=utf-8")
+
+
+async def view_blacklist_json(app, request, send):
+    if await in_thread(rate_limited, request, "view_blacklist_json", VIEW_LIMITS):
+        return await send_json(send, {"error": "Rate limit exceeded"}, 429)
+    try:
+        query = request.query.get("q", [""])[0]
+        page = int(request.query.get("page", [1])[0])
+        per_page = int(request.query.get("per_page", [50])[0])
+    except ValueError:
+        return await send_json(send, {"error": "page and per_page must be integers"}, 400)
+    etag = await in_thread(blacklist_view.etag, query, page, per_page)
+    build = lambda encoding: blacklist_view.render(
+        ("json", query, page, per_page), lambda rows: fast_json.dumps(blacklist_view.page(query, page, per_page)),
+        cache=shared_cache, encoding=encoding)
+    await send_conditional(request, send, etag, build, "application/json")
+
+
+def int_param(request, name, default):
+    try:
+        return int(request.query.get(name, [default])[0])
+    except ValueError:
+        return default
+
+
+async def search_blacklist(app, request, send):
+    if await authenticate(request) is None:
+        return await send_json(send, {"error": "Invalid or missing API key"}, 401)
+    if await in_thread(rate_limited, request, "search_blacklist"):
+        return await send_json(send, {"error": "Rate limit exceeded"}, 429)
+    query = request.query.get("q", [""])[0].strip()
+    if not query:
+        return await send_json(send, {"error": "Missing search query: q"}, 400)
+    results = await in_thread(search_results, ban_store, query, int_param(request, "page", 1),
+                              int_param(request, "per_page", SEARCH_PAGE_SIZE))
+    await send_json(send, results)
+
+
+async def blacklist_changes(app, request, send):
+    if await authenticate(request) is None:
+        return await send_json(send, {"error": "Invalid or missing API key"}, 401)
+    if await in_thread(rate_limited, request, "blacklist_changes"):
+        return await send_json(send, {"error": "Rate limit exceeded"}, 429)
+    since = int_param(request, "since", 0)
+    limit = min(int_param(request, "limit", CHANGE_FEED_PAGE_SIZE), CHANGE_FEED_PAGE_SIZE)
+    changes, latest, reset = await in_thread(change_feed.since, since, limit)
+    await send_json(send, {
+        "version": latest,
+        "changes": changes,
+        "reset": reset,
+        "more": bool(changes) and changes[-1]["seq"] < latest
+    })
+
+
+async def blacklist_changes_stream(app, request, send):
+    if await authenticate(request) is None:
+        return await send_json(send, {"error": "Invalid or missing API key"}, 401)
+    if await in_thread(rate_limited, request, "blacklist_changes_stream"):
+        return await send_json(send, {"error": "Rate limit exceeded"}, 429)
+    try:
+        since = int(request.headers.get("last-event-id", ""))
+    except ValueError:
+        since = int_param(request, "since", 0)
+
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no")],
+    })
+    try:
+        last_sent = time.monotonic()
+        while not disconnected.is_set():
+            changes, latest, reset = await in_thread(change_feed.since, since)
+            chunks = []
+            if reset:
+                chunks.append(sse_reset(latest))
+                since = latest
+            for record in changes:
+                chunks.append(sse_event(record))
+                since = record["seq"]
+            if not chunks and time.monotonic() - last_sent >= CHANGE_STREAM_HEARTBEAT_SECONDS:
+                chunks.append(": keep-alive\n\n")
+            if chunks:
+                await send({"type": "http.response.body", "body": "".join(chunks).encode(), "more_body": True})
+                last_sent = time.monotonic()
+            try:
+                await asyncio.wait_for(disconnected.wait(), CHANGE_STREAM_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        watcher.cancel()
+
+
+ROUTES = {"/check_blacklist/batch", "/view_blacklist", "/view_blacklist/json", "/blacklist/changes",
+          "/blacklist/changes/stream", "/blacklist/search", "/metrics"}
+
+
+def route_name(path):
+    # Keeps the route label bounded: identifiers are not part of it
+    if path.startswith("/check_blacklist/") and path != "/check_blacklist/batch":
+        return "/check_blacklist/<identifier>"
+    return path if path in ROUTES else "unmatched"
+
+
+class BlacklistApp:
+    def __init__(self):
+        self.session = None
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # One pooled client for every outbound call this process makes
+                self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=100))
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.session is not None:
+                    await self.session.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=100))
+
+        request = Request(scope, receive)
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if request.response_headers:
+                    message = dict(message, headers=list(message.get("headers", []))
+                                   + [(name.encode(), value.encode()) for name, value in request.response_headers])
+            await send(message)
+
+        try:
+            await self.route(request, send_and_record)
+        finally:
+            metrics.observe("http_request_duration_seconds", time.perf_counter() - started,
+                            app="asgi", route=route_name(request.path), method=request.method, status=status[0])
+
+    async def route(self, request, send):
+        try:
+            if request.method == "GET" and request.path.startswith("/check_blacklist/"):
+                identifier = unquote(request.path[len("/check_blacklist/"):])
+                if identifier and "/" not in identifier:
+                    return await check_blacklist(self, request, send, identifier)
+            elif request.method == "POST" and request.path == "/check_blacklist/batch":
+                return await check_blacklist_batch(self, request, send)
+            elif request.method == "GET" and request.path == "/view_blacklist":
+                return await view_blacklist(self, request, send)
+            elif request.method == "GET" and request.path == "/view_blacklist/json":
+                return await view_blacklist_json(self, request, send)
+            elif request.method == "GET" and request.path == "/blacklist/changes":
+                return await blacklist_changes(self, request, send)
+            elif request.method == "GET" and request.path == "/blacklist/changes/stream":
+                return await blacklist_changes_stream(self, request, send)
+            elif request.method == "GET" and request.path == "/blacklist/search":
+                return await search_blacklist(self, request, send)
+            elif request.method == "GET" and request.path == "/metrics":
+                return await send_response(send, 200, metrics.render().encode(), "text/plain; version=0.0.4")
+            await send_json(send, {"error": "Not found"}, 404)
+        except Exception as e:
+            logger.error(f"Error handling {request.method} {request.path}: {str(e)}", exc_info=True)
+            await send_json(send, {"error": "Internal server error"}, 500)
+
+
+app = BlacklistApp()
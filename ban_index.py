@@ -0,0 +1,186 @@
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+from identifiers import canonical, entry_aliases, is_uuid
+from storage_utils import file_signature, fsync_directory
+
+# Compiled, read-only form of the ban list that workers mmap instead of each
+# holding it in a dict. Pages come from the shared page cache and lookups
+# binary-search the file in place, so a check allocates little more than the
+# matching record, and memory doesn't grow with the list in every worker.
+#
+# Layout (integers big-endian):
+#   header: b"BIX1" | state: 5 x u64 | uuid count: u64 | snowflake count: u64 | name count: u64
+#   uuid table:      count x (uuid: 16 bytes | record offset: u64)
+#   snowflake table: count x (snowflake: u64 | record offset: u64)
+#   name table:      count x (blake2b(alias, digest_size=8) | record offset: u64)
+#   records:         (length: u32 | JSON [user_id, details]) ...
+#
+# Every canonical alias of an entry (identifiers.entry_aliases) goes to one
+# table: undashed UUIDs as 128-bit keys, Discord snowflakes as 64-bit keys and
+# anything else (usernames) by hash. Each table is sorted by key, and among
+# equal keys an entry's own key sorts before its other aliases and then in list
+# order, which is the precedence BanStore.find has. Keys that aren't exact
+# (hashes, snowflakes with leading zeros) are checked against the record.
+#
+# `state` is the snapshot signature and journal position the index was built
+# from. The index is current while the files on disk still match it. After
+# later appends to the same journal, BanStore answers from the index plus the
+# journal records past that position. The index is rebuilt whenever the
+# journal is compacted (BanStore.compact).
+MAGIC = b"BIX1"
+HEADER = struct.Struct(">4s5Q3Q")
+OFFSET = struct.Struct(">Q")
+RECORD_LENGTH = struct.Struct(">I")
+UUID_TABLE, SNOWFLAKE_TABLE, NAME_TABLE = range(3)
+KEY_WIDTHS = (16, 8, 8)
+
+
+def disk_state(snapshot_path, journal_path):
+    # What the index must have been built from to still be current
+    snapshot = file_signature(snapshot_path) or (0, 0, 0)
+    journal = file_signature(journal_path)
+    return (*snapshot, journal[0] if journal else 0, journal[2] if journal else 0)
+
+
+def _table_key(alias):
+    if is_uuid(alias):
+        return UUID_TABLE, bytes.fromhex(alias)
+    if alias.isdigit() and int(alias) < 1 << 64:
+        return SNOWFLAKE_TABLE, int(alias).to_bytes(8, "big")
+    return NAME_TABLE, hashlib.blake2b(alias.encode("utf-8"), digest_size=8).digest()
+
+
+def build_index(path, items, state):
+    # Writes the index for `items` ((user_id, details) pairs, in list order) to
+    # a temporary file next to `path` and returns its name; the caller installs
+    # it with install_index once `state` is known to be current.
+    records = []
+    tables = ([], [], [])
+    offset = 0
+    for position, (user_id, details) in enumerate(items):
+        record = json.dumps([user_id, details], separators=(",", ":")).encode("utf-8")
+        for rank, alias in enumerate(entry_aliases(user_id, details)):
+            table, key = _table_key(alias)
+            tables[table].append((key, rank != 0, position, offset))
+        records.append(RECORD_LENGTH.pack(len(record)) + record)
+        offset += RECORD_LENGTH.size + len(record)
+    for entries in tables:
+        entries.sort()
+
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, *state, *(len(entries) for entries in tables)))
+        for entries in tables:
+            f.write(b"".join(key + OFFSET.pack(offset) for key, _, _, offset in entries))
+        f.write(b"".join(records))
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp_path
+
+
+def install_index(tmp_path, path):
+    os.replace(tmp_path, path)
+    fsync_directory(path)
+
+
+class _Keys:
+    # Sequence view of one table's keys for bisect, read straight from the map
+    def __init__(self, buffer, start, count, key_width):
+        self.buffer = buffer
+        self.start = start
+        self.count = count
+        self.key_width = key_width
+        self.entry_width = key_width + OFFSET.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        position = self.start + i * self.entry_width
+        return self.buffer[position:position + self.key_width]
+
+
+class _MappedIndex:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, *fields = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise ValueError(f"Not a ban index: {path}")
+        self.state = tuple(fields[:5])
+        self.tables = []
+        position = HEADER.size
+        for count, key_width in zip(fields[5:], KEY_WIDTHS):
+            self.tables.append(_Keys(self.buffer, position, count, key_width))
+            position += count * (key_width + OFFSET.size)
+        self.records_start = position
+
+    def _record(self, offset):
+        position = self.records_start + offset
+        (length,) = RECORD_LENGTH.unpack_from(self.buffer, position)
+        start = position + RECORD_LENGTH.size
+        return json.loads(self.buffer[start:start + length])
+
+    def matches(self, identifier):
+        # (user_id, details) of every ban `identifier` is an alias of, in the
+        # order find() prefers them
+        alias = canonical(identifier)
+        if alias is None:
+            return
+        table, key = _table_key(alias)
+        keys = self.tables[table]
+        i = bisect.bisect_left(keys, key)
+        while i < len(keys) and keys[i] == key:
+            position = keys.start + i * keys.entry_width + keys.key_width
+            user_id, details = self._record(OFFSET.unpack_from(self.buffer, position)[0])
+            if table == UUID_TABLE or alias in entry_aliases(user_id, details):
+                yield user_id, details
+            i += 1
+
+    def find(self, identifier):
+        # (user_id, details) of the ban `identifier` matches, or None
+        return next(self.matches(identifier), None)
+
+
+class BanIndex:
+    # Per-process reader. The file is re-mapped when a writer replaces it; a map
+    # still in use by another thread stays valid until it is dropped.
+
+    def __init__(self, path, snapshot_path, journal_path):
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._mapped = None
+
+    def current(self):
+        # The mapped index if it reflects the ban files on disk, else None
+        mapped = self.latest()
+        if mapped is None or mapped.state != disk_state(self.snapshot_path, self.journal_path):
+            return None
+        return mapped
+
+    def latest(self):
+        # The index file as last written, mapped, whatever state it was built from
+        signature = file_signature(self.path)
+        if signature is None:
+            return None
+        mapped = self._mapped
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    try:
+                        self._mapped = _MappedIndex(self.path)
+                    except (FileNotFoundError, ValueError, struct.error):
+                        # Replaced between the stat and the open, or not an index
+                        return None
+                    self._signature = signature
+                mapped = self._mapped
+        return mapped
+
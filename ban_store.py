@@ -0,0 +1,585 @@
+import hashlib
+import heapq
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+import metrics
+from api_key_store import parse_expiry
+from ban_index import BanIndex, build_index, disk_state, install_index
+from bloom import BloomFilter
+from identifiers import LOOKUP_FIELDS, canonical, entry_aliases, field_alias
+from search_index import SEARCH_PAGE_SIZE, SearchIndex
+from storage_utils import atomic_write_json, file_lock, file_signature, truncate_partial_line
+
+logger = logging.getLogger(__name__)
+
+# Journal records appended since the last snapshot before a ban/unban compacts them
+COMPACT_EVERY = int(os.getenv("BAN_JOURNAL_COMPACT_EVERY", 1000))
+# Bloom filter over every canonical alias find() can match. It is sized for
+# BLOOM_HEADROOM times the current aliases, so bans applied from the journal
+# can be added without a rebuild until that capacity is used up.
+BLOOM_FP_RATE = float(os.getenv("BLOOM_FP_RATE", 0.001))
+BLOOM_HEADROOM = float(os.getenv("BLOOM_HEADROOM", 2.0))
+BLOOM_MIN_CAPACITY = 1024
+
+# Journal records past the mmap index a lookup has to consider: the bans (or
+# None for unbans) in journal order, the aliases of those bans, and how far
+# into the journal they were read
+_Overlay = namedtuple("_Overlay", ["index", "offset", "entries", "bans", "by_alias"])
+
+
+def ban_expires_at(details):
+    # Timestamp a time-limited ban ends at (its optional "expires_at", naive UTC
+    # isoformat like every stored time), or None for a permanent ban
+    try:
+        return parse_expiry(details.get("expires_at"))
+    except (TypeError, ValueError):
+        return None
+
+
+def ban_expired(details, now=None):
+    expires_at = ban_expires_at(details)
+    return expires_at is not None and expires_at <= (time.time() if now is None else now)
+
+
+def _extends(index_state, state):
+    # True if the files in `state` are the ones the index was built from plus
+    # appends to its journal (or to a journal created since)
+    if index_state[:3] != state[:3]:
+        return False
+    return index_state[3:] == (0, 0) or (index_state[3] == state[3] and index_state[4] <= state[4])
+
+
+class BanStore:
+    # Keeps banned_users.json in memory with one hash index from every canonical
+    # alias of an entry (its key, Minecraft UUIDs and usernames, see
+    # identifiers.py) to the entry key, so any identifier form is one lookup.
+    #
+    # Bans and unbans are appended to a JSON-lines journal next to the snapshot
+    # and fsynced, so a write costs O(1) instead of rewriting the whole file.
+    # Readers fold the journal over the snapshot, and only read the journal tail
+    # they have not seen yet. compact() folds the journal back into the snapshot
+    # with write-to-temp + os.replace. A lock file serialises appends and
+    # compaction between gunicorn workers. Every mutation is also published to
+    # the optional change feed, in journal order.
+    #
+    # With an index_path, the files are compiled into the mmap'd index of
+    # ban_index.py whenever the journal is compacted. Lookups (lookup, find_many,
+    # get, find_by) then answer from the index plus the few journal records
+    # appended since it was built, without loading the list into this process
+    # at all; so do writes. Only readers of the whole list (snapshot, search,
+    # the Bloom filter, expiry) load it.
+    #
+    # search() matches display names, usernames and reasons through the trigram
+    # index of search_index.py, maintained alongside the alias index.
+
+    def __init__(self, file_path, compact_every=COMPACT_EVERY, change_feed=None, index_path=None):
+        self.file_path = file_path
+        self.change_feed = change_feed
+        self.journal_path = f"{file_path}.journal"
+        self.lock_path = f"{file_path}.lock"
+        self.index_path = index_path
+        self._index = BanIndex(index_path, file_path, self.journal_path) if index_path else None
+        self._overlay = None
+        self._overlay_lock = threading.Lock()
+        self.compact_every = compact_every
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._signature = None
+        self._journal_inode = None
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self.banned_users = {}
+        self._by_alias = {}
+        self._bloom = BloomFilter.for_capacity(BLOOM_MIN_CAPACITY, BLOOM_FP_RATE)
+        self._bloom_capacity = BLOOM_MIN_CAPACITY
+        self._search = None
+        self._expiring = []  # Heap of (expires_at, user_id); entries go stale on unban/reban
+
+    def _load_file(self):
+        try:
+            with open(self.file_path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _index_entry(self, user_id, details, aliases=None):
+        for alias in aliases or entry_aliases(user_id, details):
+            # Several entries may share an alias; the first one indexed wins lookups
+            self._by_alias.setdefault(alias, []).append(user_id)
+            self._bloom.add(alias)
+        if self._search is not None:
+            self._search.add(user_id, details)
+        expires_at = ban_expires_at(details)
+        if expires_at is not None:
+            heapq.heappush(self._expiring, (expires_at, user_id))
+
+    def _unindex_entry(self, user_id, details):
+        for alias in entry_aliases(user_id, details):
+            user_ids = self._by_alias.get(alias)
+            if user_ids and user_id in user_ids:
+                user_ids.remove(user_id)
+                if not user_ids:
+                    del self._by_alias[alias]
+        if self._search is not None:
+            self._search.remove(user_id)
+
+    def _reindex(self, banned_users):
+        self.banned_users = banned_users
+        self._by_alias = {}
+        self._search = None  # Rebuilt by the next search
+        self._expiring = []
+        aliases = {user_id: entry_aliases(user_id, details) for user_id, details in banned_users.items()}
+        # Unbanned aliases are dropped from the filter only here
+        alias_count = sum(len(entry) for entry in aliases.values())
+        self._bloom_capacity = max(int(alias_count * BLOOM_HEADROOM), BLOOM_MIN_CAPACITY)
+        self._bloom = BloomFilter.for_capacity(self._bloom_capacity, BLOOM_FP_RATE)
+        for user_id, details in banned_users.items():
+            self._index_entry(user_id, details, aliases[user_id])
+
+    def _apply(self, record):
+        user_id = record["user_id"]
+        previous = self.banned_users.pop(user_id, None)
+        if previous is not None:
+            self._unindex_entry(user_id, previous)
+        if record["op"] == "ban":
+            self.banned_users[user_id] = record["details"]
+            self._index_entry(user_id, record["details"])
+            if self._bloom.count > self._bloom_capacity:
+                self._reindex(self.banned_users)
+
+    def _read_journal(self, offset):
+        # Applies complete records after `offset`. A half-written last line is
+        # left alone (the next append cuts it off); complete lines that don't
+        # parse are logged and skipped.
+        try:
+            with open(self.journal_path, "rb") as f:
+                inode = os.fstat(f.fileno()).st_ino
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return None, 0
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.error(f"Skipping unreadable record in {self.journal_path}: {line[:200]!r}")
+                continue
+            self._apply(record)
+            self._journal_entries += 1
+        return inode, offset + end
+
+    def _full_reload(self):
+        with file_lock(self.lock_path, shared=True):
+            signature = file_signature(self.file_path)
+            with metrics.timer("json_io_seconds", file="banned_users", op="load"):
+                self._reindex(self._load_file())
+            self._journal_entries = 0
+            self._journal_inode, self._journal_offset = self._read_journal(0)
+            self._signature = signature
+            self._loaded = True
+
+    def refresh(self):
+        signature = file_signature(self.file_path)
+        journal = file_signature(self.journal_path)
+        journal_inode, journal_size = (journal[0], journal[2]) if journal else (None, 0)
+        if (signature == self._signature and journal_inode == self._journal_inode
+                and journal_size == self._journal_offset):
+            return
+        with self._lock:
+            if signature == self._signature and journal_inode == self._journal_inode:
+                with file_lock(self.lock_path, shared=True):
+                    # Only the tail is new, unless a compaction slipped in since the stat
+                    if file_signature(self.file_path) == self._signature:
+                        self._journal_inode, self._journal_offset = self._read_journal(self._journal_offset)
+                        return
+            # The snapshot was compacted or replaced under us
+            self._full_reload()
+
+    def _append(self, *records, expect_state=None):
+        # All records go to the journal (and the change feed) with one fsync.
+        # With `expect_state`, nothing is written (and False returned) unless
+        # the files on disk are still in that state.
+        data = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        with self._lock:
+            with file_lock(self.lock_path), metrics.timer("json_io_seconds", file="banned_users", op="append"):
+                # A crash mid-append leaves a partial last line; these records must start a line of their own
+                truncate_partial_line(self.journal_path)
+                if expect_state is not None and disk_state(self.file_path, self.journal_path) != expect_state:
+                    return False
+                with open(self.journal_path, "a") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                if self.change_feed is not None:
+                    self.change_feed.append_many(
+                        [(record["op"], record["user_id"], record.get("details")) for record in records])
+            if self.compact_every and self._pending_entries() >= self.compact_every:
+                self.compact()
+        return True
+
+    def _pending_entries(self):
+        # Journal records the next compaction folds in, or with the index, the
+        # records past it (the index is rebuilt by every compaction), which
+        # needs no copy of the list
+        indexed = self._indexed()
+        if indexed is not None:
+            return indexed[1].entries
+        self.refresh()
+        return self._journal_entries
+
+    def compact(self, records=()):
+        # `records` not yet in the journal are folded in too, which is how large
+        # batches are written: one snapshot rewrite instead of a journal as big
+        with self._lock:
+            with file_lock(self.lock_path), metrics.timer("json_io_seconds", file="banned_users", op="compact"):
+                # Fold everything on disk, including other workers' appends
+                bans = self._fold_files()
+                for record in records:
+                    if record["op"] == "ban":
+                        bans[record["user_id"]] = record["details"]
+                    else:
+                        bans.pop(record["user_id"], None)
+                atomic_write_json(self.file_path, bans, indent=4)
+                with open(self.journal_path, "w") as f:
+                    os.fsync(f.fileno())
+                if self.index_path:
+                    # Installed before the lock is released, so lookups never
+                    # find the new snapshot without an index for it
+                    with metrics.timer("json_io_seconds", file="banned_users", op="index"):
+                        state = disk_state(self.file_path, self.journal_path)
+                        install_index(build_index(self.index_path, bans.items(), state), self.index_path)
+                if self._loaded or self._index is None:
+                    self._reindex(bans)
+                    self._signature = file_signature(self.file_path)
+                    self._journal_inode = file_signature(self.journal_path)[0]
+                    self._journal_offset = 0
+                    self._journal_entries = 0
+                    self._loaded = True
+                if records and self.change_feed is not None:
+                    self.change_feed.append_many(
+                        [(record["op"], record["user_id"], record.get("details")) for record in records])
+
+    def _state(self):
+        # The disk_state this process has applied
+        snapshot = self._signature or (0, 0, 0)
+        return (*snapshot, self._journal_inode or 0, self._journal_offset)
+
+    def _read_files(self):
+        # (bans, disk_state) straight from the snapshot and journal, leaving this
+        # process's copy alone, so any thread can build from it
+        with file_lock(self.lock_path, shared=True):
+            return self._fold_files(), disk_state(self.file_path, self.journal_path)
+
+    def _fold_files(self):
+        # The journal applied to the snapshot; call with the lock file held
+        bans = self._load_file()
+        try:
+            with open(self.journal_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        for line in data[:data.rfind(b"\n") + 1].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Blank, or unreadable (_read_journal logs those)
+            if record["op"] == "ban":
+                bans[record["user_id"]] = record["details"]
+            else:
+                bans.pop(record["user_id"], None)
+        return bans
+
+    def write_index(self):
+        # Compiles the files on disk into the index. It is installed only if
+        # nothing was written meanwhile; lookups read a write that got in
+        # between from the journal until the next compaction. Builds are
+        # serialized across processes, and skipped once another one's build
+        # made the index current.
+        if not self.index_path:
+            return
+        with file_lock(f"{self.index_path}.lock"):
+            if self._index.current() is not None:
+                return
+            with metrics.timer("json_io_seconds", file="banned_users", op="index"):
+                bans, state = self._read_files()
+                tmp_path = build_index(self.index_path, bans.items(), state)
+            del bans
+            with file_lock(self.lock_path):
+                if disk_state(self.file_path, self.journal_path) == state:
+                    install_index(tmp_path, self.index_path)
+                    return
+            os.remove(tmp_path)
+
+    def ensure_index(self):
+        # Builds the index at startup (e.g. in the gunicorn master) if it is
+        # missing or out of date. True when lookups are served from it.
+        if self._index is None:
+            return False
+        if self._index.current() is None:
+            self.write_index()
+        return self._indexed() is not None
+
+    def _indexed(self):
+        # (index, overlay) to answer lookups from, or None to use the list in
+        # memory. While a compaction holds the lock file, the snapshot on disk
+        # may be newer than the index; the index for it is ready once the lock
+        # is free.
+        if self._index is None:
+            return None
+        mapped = self._index.latest()
+        if mapped is None:
+            return None
+        state = disk_state(self.file_path, self.journal_path)
+        if not _extends(mapped.state, state):
+            with file_lock(self.lock_path, shared=True):
+                mapped = self._index.latest()
+                state = disk_state(self.file_path, self.journal_path)
+            if mapped is None or not _extends(mapped.state, state):
+                return None
+        return mapped, self._overlay_for(mapped, state[4])
+
+    def _overlay_for(self, mapped, journal_size):
+        # The journal records past `mapped`, read incrementally. An overlay is
+        # never changed once built, so readers can use one without the lock.
+        overlay = self._overlay
+        if overlay is not None and overlay.index is mapped and overlay.offset >= journal_size:
+            return overlay
+        with self._overlay_lock:
+            overlay = self._overlay
+            if overlay is None or overlay.index is not mapped:
+                overlay = _Overlay(mapped, mapped.state[4], 0, {}, {})
+            try:
+                with open(self.journal_path, "rb") as f:
+                    f.seek(overlay.offset)
+                    data = f.read()
+            except FileNotFoundError:
+                data = b""
+            end = data.rfind(b"\n") + 1
+            if end:
+                bans = dict(overlay.bans)
+                entries = overlay.entries
+                for line in data[:end].splitlines():
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Blank, or unreadable (_read_journal logs those)
+                    # Popped first so a re-ban moves to the end, as in _apply
+                    bans.pop(record["user_id"], None)
+                    bans[record["user_id"]] = record["details"] if record["op"] == "ban" else None
+                    entries += 1
+                by_alias = {}
+                for user_id, details in bans.items():
+                    if details is not None:
+                        for alias in entry_aliases(user_id, details):
+                            by_alias.setdefault(alias, []).append(user_id)
+                overlay = _Overlay(mapped, overlay.offset + end, entries, bans, by_alias)
+            self._overlay = overlay
+            return overlay
+
+    @staticmethod
+    def _indexed_matches(indexed, identifier):
+        # (user_id, details) of every ban `identifier` matches, in find() order:
+        # the entry it is the key of, then the index's bans that the journal
+        # hasn't replaced, then the bans appended since
+        mapped, overlay = indexed
+        if overlay.bans.get(identifier) is not None:
+            yield identifier, overlay.bans[identifier]
+        for user_id, details in mapped.matches(identifier):
+            if user_id not in overlay.bans:
+                yield user_id, details
+        for user_id in overlay.by_alias.get(canonical(identifier), ()):
+            yield user_id, overlay.bans[user_id]
+
+    @property
+    def version(self):
+        # Identifies the data currently on disk; identical in every worker, and
+        # different after any ban/unban
+        state = disk_state(self.file_path, self.journal_path)
+        return hashlib.sha1(repr(state).encode()).hexdigest()[:20]
+
+    @property
+    def last_modified(self):
+        mtimes = [sig[1] for sig in (file_signature(self.file_path), file_signature(self.journal_path)) if sig]
+        return max(mtimes) / 1e9 if mtimes else 0.0
+
+    def snapshot(self):
+        # A copy: the list changes in place whenever this process applies a
+        # write, which may happen on another thread (e.g. the expiry sweeper)
+        self.refresh()
+        with self._lock:
+            return dict(self.banned_users)
+
+    def get(self, user_id):
+        indexed = self._indexed()
+        if indexed is not None:
+            return next((details for match, details in self._indexed_matches(indexed, user_id) if match == user_id), None)
+        self.refresh()
+        return self.banned_users.get(user_id)
+
+    def iter_bans(self):
+        # (user_id, details) pairs, safe to consume while other requests apply changes
+        self.refresh()
+        with self._lock:
+            items = list(self.banned_users.items())
+        return iter(items)
+
+    @staticmethod
+    def _first(index, value):
+        user_ids = index.get(value)
+        return user_ids[0] if user_ids else None
+
+    def find(self, identifier):
+        # Discord ID, either Minecraft UUID field or a stored username, in any spelling
+        self.refresh()
+        with self._lock:
+            if identifier in self.banned_users:
+                return identifier
+            return self._first(self._by_alias, canonical(identifier))
+
+    def lookup(self, identifier):
+        # (user_id, details) of the ban find(identifier) would return, or None.
+        # A time-limited ban that has run out no longer matches, even before
+        # the sweeper removes it.
+        match = self._lookup(identifier)
+        return match if match is not None and not ban_expired(match[1]) else None
+
+    def _lookup(self, identifier):
+        indexed = self._indexed()
+        if indexed is not None:
+            metrics.inc("ban_lookup_total", source="index")
+            return next(self._indexed_matches(indexed, identifier), None)
+        # No index. Most players checked are not banned; the Bloom filter
+        # answers those without the hash indexes.
+        if not self.might_contain(identifier):
+            metrics.inc("ban_lookup_total", source="bloom")
+            return None
+        metrics.inc("ban_lookup_total", source="memory")
+        user_id = self.find(identifier)
+        details = self.get(user_id) if user_id is not None else None
+        return (user_id, details) if details is not None else None
+
+    def might_contain(self, identifier):
+        # False means find(identifier) is certainly None; True may be a false positive
+        self.refresh()
+        return canonical(identifier) in self._bloom
+
+    def bloom_filter(self):
+        self.refresh()
+        return self._bloom
+
+    def find_many(self, identifiers):
+        # Resolves every identifier against one consistent view of the data
+        matches = {}
+        indexed = self._indexed()
+        if indexed is not None:
+            for identifier in identifiers:
+                match = next(self._indexed_matches(indexed, identifier), None)
+                if match is not None and not ban_expired(match[1]):
+                    matches[identifier] = match
+            return matches
+        self.refresh()
+        with self._lock:
+            banned_users = self.banned_users
+            for identifier in identifiers:
+                user_id = identifier if identifier in banned_users else self._first(self._by_alias, canonical(identifier))
+                if user_id is not None and not ban_expired(banned_users[user_id]):
+                    matches[identifier] = (user_id, banned_users[user_id])
+        return matches
+
+    def find_by(self, field, identifier):
+        if field == "user_id":
+            return identifier if self.get(identifier) is not None else None
+        if field not in LOOKUP_FIELDS:
+            raise ValueError(f"Unknown field: {field}")
+        alias = canonical(identifier)
+        indexed = self._indexed()
+        if indexed is not None:
+            return next((user_id for user_id, details in self._indexed_matches(indexed, identifier)
+                         if field_alias(details, field) == alias), None)
+        self.refresh()
+        with self._lock:
+            for user_id in self._by_alias.get(alias, ()):
+                if field_alias(self.banned_users[user_id], field) == alias:
+                    return user_id
+        return None
+
+    def search(self, query, offset=0, limit=SEARCH_PAGE_SIZE):
+        # (total matches, [(user_id, details, score)] for one page, best first).
+        # The search index is built on first use and then kept up to date with
+        # every ban and unban applied, like the alias index.
+        self.refresh()
+        with self._lock:
+            if self._search is None:
+                self._search = SearchIndex()
+                for user_id, details in self.banned_users.items():
+                    self._search.add(user_id, details)
+            matches = self._search.search(query)
+            page = [(user_id, self.banned_users[user_id], score) for score, user_id in matches[offset:offset + limit]]
+        return len(matches), page
+
+    def ban(self, user_id, details):
+        self._append({"op": "ban", "user_id": user_id, "details": details})
+
+    def ban_many(self, entries):
+        # entries: iterable of (user_id, details), applied as one write: a journal
+        # append, or a snapshot rewrite once the batch is as big as a compaction
+        records = [{"op": "ban", "user_id": user_id, "details": details} for user_id, details in entries]
+        if self.compact_every and len(records) >= self.compact_every:
+            self.compact(records)
+        elif records:
+            self._append(*records)
+
+    def next_expiry(self):
+        # When the earliest time-limited ban ends (possibly one already lifted), or None
+        self.refresh()
+        with self._lock:
+            return self._expiring[0][0] if self._expiring else None
+
+    def expire(self, now=None):
+        # Unbans every ban whose expires_at has passed, as one journal append
+        # (published to the change feed as unbans). Returns their user_ids.
+        now = time.time() if now is None else now
+        while True:
+            with self._lock:
+                self.refresh()
+                popped = []
+                due = {}
+                while self._expiring and self._expiring[0][0] <= now:
+                    popped.append(heapq.heappop(self._expiring))
+                    user_id = popped[-1][1]
+                    details = self.banned_users.get(user_id)
+                    if details is not None and ban_expired(details, now):
+                        due[user_id] = None
+                if not due:
+                    return []
+                records = [{"op": "unban", "user_id": user_id} for user_id in due]
+                if self._append(*records, expect_state=self._state()):
+                    return list(due)
+                # Another worker wrote in between (maybe re-banning one of
+                # these); look again on top of its change
+                for item in popped:
+                    heapq.heappush(self._expiring, item)
+
+    def unban(self, user_id):
+        with self._lock:
+            if self.get(user_id) is None:
+                return False
+            self._append({"op": "unban", "user_id": user_id})
+            return True
+
+
+if __name__ == "__main__":
+    # Compaction job, e.g. from cron: python ban_store.py compact [data/banned_users.json]
+    # (also rebuilds the .idx index next to it)
+    if len(sys.argv) < 2 or sys.argv[1] != "compact":
+        sys.exit("usage: python ban_store.py compact [banned_users.json]")
+    path = sys.argv[2] if len(sys.argv) > 2 else "data/banned_users.json"
+    BanStore(path, index_path=f"{os.path.splitext(path)[0]}.idx").compact()
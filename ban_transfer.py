@@ -0,0 +1,159 @@
+import csv
+import io
+import json
+import os
+import fast_json
+from ban_views import ban_entry, validate_expiry
+from identifiers import canonical, is_uuid
+
+# Bulk import/export of ban lists as JSON Lines or CSV. Both formats carry the
+# fields POST /blacklist takes, so an export can be imported elsewhere as is:
+#
+#   {"user_id": "...", "display_name": "...", "reason": "...", "timestamp": "...",
+#    "mc_info": {"minecraft_username": "...", "minecraft_uuid": "..."},
+#    "expires_at": "..."}
+#
+# CSV flattens mc_info into minecraft_username/minecraft_uuid columns.
+
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", 100000))
+IMPORT_MAX_ERRORS = 100  # Errors listed in the response; the rest are only counted
+CSV_FIELDS = ("user_id", "display_name", "reason", "timestamp", "minecraft_username", "minecraft_uuid",
+              "expires_at")
+
+
+def _text_lines(stream):
+    # Decodes a binary request stream incrementally, one line at a time
+    return io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+
+def parse_ndjson(stream):
+    # Yields (line number, record or None, error)
+    for number, line in enumerate(_text_lines(stream), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield number, None, "Invalid JSON"
+            continue
+        if not isinstance(record, dict):
+            yield number, None, "Expected a JSON object"
+            continue
+        yield number, record, None
+
+
+def parse_csv(stream):
+    reader = csv.DictReader(_text_lines(stream))
+    for record in reader:
+        mc_info = {field: record.pop(field, None) for field in ("minecraft_username", "minecraft_uuid")}
+        record.pop(None, None)  # Cells beyond the header
+        mc_info = {field: value for field, value in mc_info.items() if value}
+        if mc_info:
+            record["mc_info"] = mc_info
+        yield reader.line_num, record, None
+
+
+def read_import(stream, fmt, resolve_uuids):
+    # Parses and validates an import body. Usernames without a UUID are
+    # resolved together at the end through resolve_uuids(usernames) ->
+    # {username: uuid or None}, which leaves out names it couldn't look up.
+    # Returns (entries, errors, error count, retryable count) where entries is
+    # a list of (user_id, details) ready for ban_many, and retryable rows are
+    # ones rejected only because a lookup failed, worth sending again later.
+    rows = parse_csv(stream) if fmt == "csv" else parse_ndjson(stream)
+    entries = []
+    errors = []
+    error_count = 0
+    retryable_count = 0
+    unresolved = {}
+
+    def fail(line, message, retryable=False):
+        nonlocal error_count, retryable_count
+        error_count += 1
+        retryable_count += retryable
+        if len(errors) < IMPORT_MAX_ERRORS:
+            error = {"line": line, "error": message}
+            if retryable:
+                error["retryable"] = True
+            errors.append(error)
+
+    for index, (line, record, error) in enumerate(rows, 1):
+        if index > IMPORT_MAX_ROWS:
+            fail(line, f"More than {IMPORT_MAX_ROWS} rows; the rest were skipped")
+            break
+        if error:
+            fail(line, error)
+            continue
+        user_id = record.get("user_id")
+        if not user_id or not record.get("reason"):
+            fail(line, "Missing required fields: user_id, reason")
+            continue
+        mc_info = record.get("mc_info") or {}
+        if not isinstance(mc_info, dict):
+            fail(line, "mc_info must be an object")
+            continue
+        expires_at, error = validate_expiry(record.get("expires_at") or None)
+        if error:
+            fail(line, error)
+            continue
+        details = ban_entry(record["reason"], record.get("display_name") or "Unknown", dict(mc_info), expires_at)
+        if record.get("timestamp"):
+            # Keep the partner's ban time rather than the import time
+            details["timestamp"] = record["timestamp"]
+        minecraft_uuid = canonical(mc_info.get("minecraft_uuid"))
+        if mc_info.get("minecraft_uuid") and not is_uuid(minecraft_uuid):
+            fail(line, "Invalid minecraft_uuid")
+            continue
+        if mc_info.get("minecraft_username") and not minecraft_uuid:
+            unresolved.setdefault(mc_info["minecraft_username"], []).append((line, len(entries)))
+        entries.append((str(user_id), details))
+
+    if unresolved:
+        uuids = resolve_uuids(list(unresolved))
+        dropped = set()
+        for username, positions in unresolved.items():
+            uuid = uuids.get(username)
+            for line, position in positions:
+                if uuid:
+                    entries[position][1]["mc_info"]["minecraft_uuid"] = uuid
+                    continue
+                if username in uuids:
+                    fail(line, f"Invalid Minecraft username: {username}")
+                else:
+                    fail(line, f"Could not look up Minecraft username {username}; try again later", retryable=True)
+                dropped.add(position)
+        entries = [entry for position, entry in enumerate(entries) if position not in dropped]
+    # A user listed twice keeps its last row
+    return list(dict(entries).items()), errors, error_count, retryable_count
+
+
+def export_record(user_id, details):
+    return {"user_id": user_id, **details}
+
+
+def export_ndjson(bans):
+    for user_id, details in bans:
+        yield fast_json.dumps(export_record(user_id, details)) + b"\n"
+
+
+def export_csv(bans):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for user_id, details in bans:
+        mc_info = details.get("mc_info") or {}
+        writer.writerow([
+            user_id,
+            details.get("display_name", ""),
+            details.get("reason", ""),
+            details.get("timestamp", ""),
+            mc_info.get("minecraft_username") or details.get("username") or "",
+            mc_info.get("minecraft_uuid", ""),
+            details.get("expires_at", ""),
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
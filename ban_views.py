@@ -0,0 +1,207 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from api_key_store import parse_expiry
+from compression import COMPRESSION_MIN_SIZE, compress
+from search_index import SEARCH_MAX_PAGE_SIZE
+
+# Response shaping shared by the Flask (api.py) and ASGI (asgi.py) entry points
+
+VIEW_MAX_PER_PAGE = 500
+VIEW_RENDER_CACHE_SIZE = 64
+MAX_BATCH_IDENTIFIERS = int(os.getenv("MAX_BATCH_IDENTIFIERS", 500))
+# A batch check costs one rate-limit unit per this many identifiers (at least one)
+BATCH_IDENTIFIERS_PER_UNIT = int(os.getenv("BATCH_IDENTIFIERS_PER_UNIT", 50))
+
+
+def ban_entry(reason, display_name, mc_info, expires_at=None):
+    # The record stored in banned_users.json for a Discord user ID; expires_at
+    # (naive UTC isoformat) makes it a time-limited ban
+    entry = {
+        "reason": reason,
+        "timestamp": datetime.utcnow().isoformat(),
+        "display_name": display_name,
+        "mc_info": mc_info
+    }
+    if expires_at is not None:
+        entry["expires_at"] = expires_at
+    return entry
+
+
+def validate_expiry(value):
+    # Returns (expires_at for ban_entry or None, error message). Timestamps with
+    # an offset are converted to UTC; ones without are taken as UTC.
+    if value is None:
+        return None, None
+    try:
+        expires_at = parse_expiry(value)
+    except (TypeError, ValueError):
+        return None, "expires_at must be an ISO 8601 timestamp"
+    if expires_at <= time.time():
+        return None, "expires_at must be in the future"
+    return datetime.fromtimestamp(expires_at, timezone.utc).replace(tzinfo=None).isoformat(), None
+
+
+def format_timestamp(timestamp):
+    if timestamp:
+        try:
+            # Parse the ISO timestamp and format it
+            dt = datetime.fromisoformat(timestamp)
+            return dt.strftime("%B %d, %Y at %I:%M %p")
+        except (ValueError, TypeError):
+            # If parsing fails, use the original timestamp
+            pass
+    return timestamp
+
+
+def format_ban(details):
+    ban = {
+        "reason": details["reason"],
+        "display_name": details.get("display_name", "Unknown"),
+        "timestamp": format_timestamp(details.get("timestamp")),
+        "mc_info": details.get('mc_info', {})
+    }
+    if details.get("expires_at"):
+        ban["expires_at"] = details["expires_at"]
+    return ban
+
+
+def validate_batch(data):
+    # Returns (identifiers, error message)
+    identifiers = data.get('identifiers') if isinstance(data, dict) else None
+    if not isinstance(identifiers, list) or not all(isinstance(i, str) for i in identifiers):
+        return None, "identifiers must be a list of strings"
+    if len(identifiers) > MAX_BATCH_IDENTIFIERS:
+        return None, f"At most {MAX_BATCH_IDENTIFIERS} identifiers per request"
+    return identifiers, None
+
+
+def batch_cost(data):
+    # Rate-limit units for a batch body, before it is validated
+    identifiers = data.get('identifiers') if isinstance(data, dict) else None
+    count = len(identifiers) if isinstance(identifiers, list) else 0
+    return max(1, -(-count // BATCH_IDENTIFIERS_PER_UNIT))
+
+
+def check_batch(store, identifiers):
+    # The store canonicalizes each identifier, so dashed UUIDs and usernames match too
+    matches = store.find_many(identifiers)
+    return {identifier: format_ban(matches[identifier][1]) if identifier in matches else {}
+            for identifier in identifiers}
+
+
+def search_results(store, query, page, per_page):
+    # GET /blacklist/search response: one page of ranked matches
+    page = max(page, 1)
+    per_page = min(max(per_page, 1), SEARCH_MAX_PAGE_SIZE)
+    total, matches = store.search(query, (page - 1) * per_page, per_page)
+    return {
+        "query": query,
+        "total": total,
+        "page": page,
+        "per_page": per_page,
+        "results": [dict(format_ban(details), user_id=user_id, score=score) for user_id, details, score in matches]
+    }
+
+
+def view_rows(banned_users):
+    # Format the data for easier template rendering
+    formatted_users = []
+    for user_id, details in banned_users.items():
+        formatted_users.append({
+            "user_id": user_id,
+            "display_name": details.get("display_name", "Unknown"),
+            "reason": details.get("reason", ""),
+            "timestamp": format_timestamp(details.get("timestamp", "")),
+            "minecraft_username": details.get("mc_info", {}).get("minecraft_username", ""),
+            "minecraft_uuid": details.get("mc_info", {}).get("minecraft_uuid", "")
+        })
+    return formatted_users
+
+
+class BlacklistView:
+    # The formatted view_blacklist rows, rebuilt once per ban data version rather
+    # than per request. Because the version comes from the files on disk, every
+    # worker derives the same ETag for the same data, and a ban or unban changes
+    # it immediately.
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._version = None
+        self.rows = []
+        self._search_text = []
+        self._rendered = {}
+
+    def refresh(self):
+        version = self.store.version
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    rows = view_rows(self.store.snapshot())
+                    self._search_text = [
+                        "\n".join(str(row[field]) for field in
+                                  ("user_id", "display_name", "reason", "minecraft_username", "minecraft_uuid")).lower()
+                        for row in rows
+                    ]
+                    self.rows = rows
+                    self._rendered = {}
+                    self._version = version
+        return version
+
+    @property
+    def last_modified(self):
+        return datetime.fromtimestamp(self.store.last_modified, timezone.utc).replace(microsecond=0)
+
+    def etag(self, *variant):
+        # Responses that also depend on something else (the session, the query) mix it in
+        version = self.refresh()
+        return hashlib.sha1(repr((version,) + variant).encode()).hexdigest()
+
+    def render(self, key, render, cache=None, encoding=None):
+        # Caches one rendered body per key for the current data version, in the
+        # shared cache backend when one is given (tagged "blacklist") or in-process.
+        # With an `encoding` the compressed body is cached too, so it is
+        # compressed once per version rather than per response. Returns
+        # (body, encoding applied or None): small bodies are not compressed.
+        version = self.refresh()
+        body = self._cached(version, key, lambda: render(self.rows), cache)
+        if encoding is None or len(body) < COMPRESSION_MIN_SIZE:
+            return body, None
+        data = body.encode("utf-8") if isinstance(body, str) else body
+        return self._cached(version, (key, encoding), lambda: compress(data, encoding), cache), encoding
+
+    def _cached(self, version, key, build, cache):
+        if cache is not None:
+            cache_key = f"view_blacklist:{version}:{key!r}"
+            body = cache.get(cache_key)
+            if body is None:
+                body = build()
+                cache.set(cache_key, body, tags=("blacklist",))
+            return body
+        body = self._rendered.get(key)
+        if body is None:
+            body = build()
+            if len(self._rendered) >= VIEW_RENDER_CACHE_SIZE:
+                self._rendered.pop(next(iter(self._rendered)))
+            self._rendered[key] = body
+        return body
+
+    def page(self, query="", page=1, per_page=50):
+        self.refresh()
+        rows = self.rows
+        query = (query or "").strip().lower()
+        if query:
+            rows = [row for row, text in zip(self.rows, self._search_text) if query in text]
+        page = max(page, 1)
+        per_page = min(max(per_page, 1), VIEW_MAX_PER_PAGE)
+        start = (page - 1) * per_page
+        return {
+            "version": self._version,
+            "total": len(rows),
+            "page": page,
+            "per_page": per_page,
+            "users": rows[start:start + per_page]
+        }
@@ -0,0 +1,122 @@
+# Serialization CPU and bytes on the wire for the large JSON responses.
+#
+#   python benchmarks/bench_compression.py --sizes 1000 100000
+#   python benchmarks/bench_compression.py --output after.json --compare before.json
+#
+# For each generated list size it builds the bodies mirrors and moderators
+# fetch: the full view_blacklist row list, one 500-row /view_blacklist/json
+# page and the NDJSON export. Each is serialized with the stdlib (as jsonify
+# did) and with fast_json, then compressed with every available encoding,
+# reporting the size, the compression ratio and the CPU per response. "cached"
+# is the cost of serving an already compressed body for an unchanged data
+# version, which is what repeat downloads pay.
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from generate_data import generate_bans
+import fast_json
+from ban_transfer import export_ndjson
+from ban_views import VIEW_MAX_PER_PAGE, view_rows
+from compression import COMPRESSION_PREFERENCE, compress
+
+
+def best_of(function, repeat):
+    # Seconds for the fastest of `repeat` runs, and its result
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def payloads(bans):
+    rows = view_rows(bans)
+    page = {"version": "bench", "total": len(rows), "page": 1, "per_page": VIEW_MAX_PER_PAGE,
+            "users": rows[:VIEW_MAX_PER_PAGE]}
+    return {
+        "view_rows": (rows, True),
+        "view_json_page": (page, True),
+        "export_ndjson": (list(bans.items()), False),
+    }
+
+
+def measure(obj, is_json, repeat):
+    if is_json:
+        # jsonify sorts keys and is compact outside debug mode
+        stdlib_seconds, body = best_of(
+            lambda: json.dumps(obj, sort_keys=True, separators=(",", ":")).encode("utf-8"), repeat)
+        fast_seconds, body = best_of(lambda: fast_json.dumps(obj, sort_keys=True), repeat)
+    else:
+        stdlib_seconds, body = best_of(lambda: "".join(
+            json.dumps({"user_id": user_id, **details}, separators=(",", ":")) + "\n"
+            for user_id, details in obj).encode("utf-8"), repeat)
+        fast_seconds, body = best_of(lambda: b"".join(export_ndjson(obj)), repeat)
+    result = {
+        "serialize_stdlib_ms": stdlib_seconds * 1000,
+        "serialize_fast_ms": fast_seconds * 1000,
+        "identity_bytes": len(body),
+        "encodings": {},
+    }
+    cache = {}
+    for encoding in COMPRESSION_PREFERENCE:
+        seconds, compressed = best_of(lambda: compress(body, encoding), repeat)
+        cache[encoding] = compressed
+        cached_seconds, _ = best_of(lambda: cache[encoding], repeat)
+        result["encodings"][encoding] = {
+            "bytes": len(compressed),
+            "ratio": len(body) / len(compressed),
+            "compress_ms": seconds * 1000,
+            "cached_ms": cached_seconds * 1000,
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write JSON results here")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    args = parser.parse_args()
+
+    report = {"json_encoder": "orjson" if fast_json.orjson else "json",
+              "encodings": list(COMPRESSION_PREFERENCE), "results": {}}
+    for size in args.sizes:
+        bans = generate_bans(size)
+        report["results"][str(size)] = {name: measure(obj, is_json, args.repeat)
+                                        for name, (obj, is_json) in payloads(bans).items()}
+
+    for size, results in report["results"].items():
+        for name, result in results.items():
+            print(f"{size:>8} {name:<15} {result['identity_bytes']:>11} B  "
+                  f"json {result['serialize_stdlib_ms']:8.2f} ms  fast {result['serialize_fast_ms']:8.2f} ms")
+            for encoding, stats in result["encodings"].items():
+                print(f"{'':>8} {'':<15} {encoding:>5} {stats['bytes']:>11} B  x{stats['ratio']:5.1f}  "
+                      f"compress {stats['compress_ms']:8.2f} ms  cached {stats['cached_ms']:.4f} ms")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        for size, results in report["results"].items():
+            for name, result in results.items():
+                before = baseline.get(size, {}).get(name)
+                if before:
+                    print(f"{size:>8} {name:<15} serialize {before['serialize_fast_ms']:8.2f} -> "
+                          f"{result['serialize_fast_ms']:8.2f} ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+# Per-endpoint latency/throughput for the API hot paths on synthetic data.
+#
+#   python benchmarks/bench_endpoints.py --sizes 1000 100000 --output results.json
+#   python benchmarks/bench_endpoints.py --sizes 1000 --gunicorn --compare results.json
+#
+# Each size gets its own temporary directory holding generated
+# data/banned_users.json and data/api_keys.json. Requests go through the Flask
+# test client (in-process, with per-request allocation peaks and file opens)
+# and optionally through a real multi-worker gunicorn. Mojang is served by the
+# local stub, and rate limiting is disabled so it doesn't cut runs short.
+# Results are JSON keyed by size and scenario; --compare prints the relative
+# change against an earlier run.
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from generate_data import BENCH_ADMIN_KEY, BENCH_API_KEY, write_dataset
+import stub_upstream
+
+# Counts file opens made by the code under test (see sys.addaudithook)
+FILE_OPENS = [0]
+
+
+def count_opens(event, args):
+    if event == "open":
+        FILE_OPENS[0] += 1
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(latencies, elapsed, extra=None):
+    result = {
+        "requests": len(latencies),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "requests_per_second": len(latencies) / elapsed if elapsed else 0.0,
+    }
+    result.update(extra or {})
+    return result
+
+
+def scenarios(bans, rng):
+    # (name, method, path, json body, api key)
+    banned_ids = list(bans)
+    minecraft_uuids = [d["mc_info"]["minecraft_uuid"] for d in bans.values() if d["mc_info"].get("minecraft_uuid")]
+    batch = [rng.choice(banned_ids) for _ in range(50)] + [str(rng.randrange(10 ** 17, 10 ** 19)) for _ in range(50)]
+    return [
+        ("check_blacklist_hit", "GET", lambda: f"/check_blacklist/{rng.choice(banned_ids)}", None, BENCH_API_KEY),
+        ("check_blacklist_uuid_hit", "GET", lambda: f"/check_blacklist/{rng.choice(minecraft_uuids)}", None, BENCH_API_KEY),
+        ("check_blacklist_miss", "GET", lambda: f"/check_blacklist/{rng.randrange(10 ** 17, 10 ** 19)}", None, BENCH_API_KEY),
+        ("check_blacklist_bad_key", "GET", lambda: f"/check_blacklist/{rng.choice(banned_ids)}", None, "not-a-key"),
+        ("check_blacklist_batch_100", "POST", lambda: "/check_blacklist/batch", {"identifiers": batch}, BENCH_API_KEY),
+        ("view_blacklist_json", "GET", lambda: "/view_blacklist/json?page=1&per_page=50", None, None),
+        ("view_blacklist_json_search", "GET", lambda: "/view_blacklist/json?q=cheating&per_page=50", None, None),
+        ("blacklist_user", "POST", lambda: "/blacklist", None, BENCH_ADMIN_KEY),
+    ]
+
+
+def ban_body(rng):
+    return {
+        "user_id": str(rng.randrange(10 ** 17, 10 ** 19)),
+        "display_name": "bench",
+        "reason": "benchmark ban",
+        "mc_info": {"minecraft_uuid": "%032x" % rng.getrandbits(128)},
+    }
+
+
+def run_test_client(bans, iterations, seed):
+    # Imported here: api.py reads its data paths relative to the working directory
+    import api
+    client = api.create_app().test_client()
+    rng = random.Random(seed)
+    results = {}
+    for name, method, path, body, key in scenarios(bans, rng):
+        headers = {"X-API-Key": key} if key else {}
+        latencies = []
+        peaks = []
+        opens_before = FILE_OPENS[0]
+        start = time.perf_counter()
+        for _ in range(iterations):
+            payload = ban_body(rng) if name == "blacklist_user" else body
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            t0 = time.perf_counter()
+            response = client.open(path(), method=method, json=payload, headers=headers)
+            latencies.append(time.perf_counter() - t0)
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+            if response.status_code >= 500:
+                raise RuntimeError(f"{name}: HTTP {response.status_code}")
+        elapsed = time.perf_counter() - start
+        results[name] = summarize(latencies, elapsed, {
+            "peak_alloc_bytes_p50": percentile(peaks, 0.50),
+            "file_opens_per_request": (FILE_OPENS[0] - opens_before) / iterations,
+        })
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_gunicorn(directory, bans, requests_per_scenario, concurrency, workers, seed, env):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", os.path.join(REPO_DIR, "gunicorn.conf.py"),
+         "--chdir", directory, "--pythonpath", REPO_DIR, "--workers", str(workers),
+         "--bind", f"127.0.0.1:{port}", "--log-level", "warning", "wsgi:app"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                urllib.request.urlopen(base + "/check_login", timeout=1)
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise RuntimeError("gunicorn did not start")
+                time.sleep(0.2)
+
+        rng = random.Random(seed)
+        results = {}
+        for name, method, path, body, key in scenarios(bans, rng):
+            requests = []
+            for _ in range(requests_per_scenario):
+                payload = ban_body(rng) if name == "blacklist_user" else body
+                headers = {"Content-Type": "application/json"}
+                if key:
+                    headers["X-API-Key"] = key
+                data = json.dumps(payload).encode() if payload is not None else None
+                requests.append(urllib.request.Request(base + path(), data=data, headers=headers, method=method))
+
+            def send(req):
+                t0 = time.perf_counter()
+                try:
+                    urllib.request.urlopen(req, timeout=30).read()
+                except urllib.error.HTTPError as e:
+                    e.read()
+                return time.perf_counter() - t0
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as pool:
+                latencies = list(pool.map(send, requests))
+            results[name] = summarize(latencies, time.perf_counter() - start,
+                                      {"workers": workers, "concurrency": concurrency})
+        return results
+    finally:
+        process.terminate()
+        process.wait(10)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    for size, modes in current["results"].items():
+        for mode, endpoints in modes.items():
+            for name, result in endpoints.items():
+                before = baseline.get("results", {}).get(size, {}).get(mode, {}).get(name)
+                if not before:
+                    continue
+                change = (result["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100 if before["p50_ms"] else 0.0
+                print(f"{size:>8} {mode:<12} {name:<28} p50 {before['p50_ms']:8.3f} -> {result['p50_ms']:8.3f} ms ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000],
+                        help="entries in each generated file (1000000 is supported but slow to generate)")
+    parser.add_argument("--iterations", type=int, default=200, help="test-client requests per scenario")
+    parser.add_argument("--gunicorn", action="store_true", help="also benchmark a real multi-worker gunicorn")
+    parser.add_argument("--gunicorn-requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write JSON results here")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    args = parser.parse_args()
+
+    report = {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "results": {},
+    }
+    original_cwd = os.getcwd()
+    # The in-process app is imported once, so each size runs in a fresh interpreter
+    if len(args.sizes) > 1:
+        for size in args.sizes:
+            command = [sys.executable, os.path.abspath(__file__), "--sizes", str(size),
+                       "--iterations", str(args.iterations), "--gunicorn-requests", str(args.gunicorn_requests),
+                       "--concurrency", str(args.concurrency), "--workers", str(args.workers),
+                       "--seed", str(args.seed)]
+            if args.gunicorn:
+                command.append("--gunicorn")
+            output = subprocess.check_output(command, text=True)
+            report["results"].update(json.loads(output)["results"])
+    else:
+        size = args.sizes[0]
+        stub = stub_upstream.serve()
+        stub_url = f"http://127.0.0.1:{stub.server_address[1]}"
+        os.environ.update({
+            "MOJANG_API_URL": stub_url,
+            "DISCORD_API_URL": f"{stub_url}/api/v10",
+            "RATELIMIT_ENABLED": "0",
+        })
+        sys.addaudithook(count_opens)
+        tracemalloc.start()
+        with tempfile.TemporaryDirectory() as directory:
+            bans = write_dataset(directory, size, size)
+            os.chdir(directory)
+            try:
+                results = {"test_client": run_test_client(bans, args.iterations, args.seed)}
+                if args.gunicorn:
+                    tracemalloc.stop()
+                    results["gunicorn"] = run_gunicorn(directory, bans, args.gunicorn_requests, args.concurrency,
+                                                       args.workers, args.seed, dict(os.environ))
+            finally:
+                os.chdir(original_cwd)
+        report["results"][str(size)] = results
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    if args.compare:
+        compare(report, args.compare)
+    if not args.output:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# Compares the limiter storages under concurrent workers.
+#
+#   python benchmarks/bench_limiter_storage.py --processes 4 --hits 500
+#
+# Every process hammers the same keys; the report shows throughput, per-hit
+# latency and how many increments were lost to races (expected - stored).
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from file_storage import FileStorage
+from sqlite_storage import SQLiteStorage
+
+STORAGES = {
+    "file": (FileStorage, "limiter.json"),
+    "sqlite": (SQLiteStorage, "limiter.db"),
+}
+
+
+def make_storage(name, directory):
+    cls, filename = STORAGES[name]
+    return cls(f"{name}://", file_path=os.path.join(directory, filename))
+
+
+def worker(args):
+    name, directory, hits, keys = args
+    storage = make_storage(name, directory)
+    latencies = []
+    for i in range(hits):
+        key = f"LIMITER/bench/{i % keys}"
+        start = time.perf_counter()
+        storage.incr(key, 3600)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(name, processes, hits, keys, preload):
+    with tempfile.TemporaryDirectory() as directory:
+        storage = make_storage(name, directory)
+        # Unrelated keys, so we can see how cost scales with the size of the store
+        for i in range(preload):
+            storage.incr(f"LIMITER/preload/{i}", 3600)
+
+        start = time.perf_counter()
+        with Pool(processes) as pool:
+            results = pool.map(worker, [(name, directory, hits, keys)] * processes)
+        elapsed = time.perf_counter() - start
+
+        latencies = [latency for result in results for latency in result]
+        storage = make_storage(name, directory)
+        stored = sum(storage.get(f"LIMITER/bench/{k}") for k in range(keys))
+        return {
+            "storage": name,
+            "processes": processes,
+            "preloaded_keys": preload,
+            "hits": len(latencies),
+            "hits_per_second": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "lost_increments": len(latencies) - stored,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--hits", type=int, default=500, help="hits per process")
+    parser.add_argument("--keys", type=int, default=10)
+    parser.add_argument("--preload", type=int, nargs="+", default=[0, 1000, 10000])
+    parser.add_argument("--storage", nargs="+", default=list(STORAGES), choices=list(STORAGES))
+    args = parser.parse_args()
+
+    results = [
+        run(name, args.processes, args.hits, args.keys, preload)
+        for preload in args.preload
+        for name in args.storage
+    ]
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
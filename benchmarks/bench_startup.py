@@ -0,0 +1,141 @@
+# Worker boot time and memory, with and without gunicorn's preload_app.
+#
+#   python benchmarks/bench_startup.py --bans 100000 --workers 4
+#   python benchmarks/bench_startup.py --output after.json --compare before.json
+#
+# For each mode it starts gunicorn on a generated dataset, times how long it
+# takes until every worker has answered a request (the first one per worker
+# loads the ban data), then reads RSS, PSS and private memory of each worker
+# from /proc (Linux only). PSS counts pages shared copy-on-write with the master
+# fractionally, so it is the number that shows what preloading saves. The cold
+# import time of wsgi.py is measured in a fresh interpreter as well.
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from generate_data import BENCH_API_KEY, write_dataset
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def memory_kb(pid):
+    # {"rss": ..., "pss": ..., "private": ...} from smaps_rollup
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:", "Private_Clean:", "Private_Dirty:"):
+                values[parts[0][:-1].lower()] = int(parts[1])
+    return {"rss": values["rss"], "pss": values["pss"],
+            "private": values["private_clean"] + values["private_dirty"]}
+
+
+def worker_pids(master_pid):
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def import_seconds(directory, env):
+    # Cold import of the WSGI module, as each worker does without preloading
+    code = "import time; t = time.perf_counter(); import wsgi; print(time.perf_counter() - t)"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=directory, text=True,
+                                     env=dict(env, PYTHONPATH=REPO_DIR), stderr=subprocess.DEVNULL)
+    return float(output.strip().splitlines()[-1])
+
+
+def run_gunicorn(directory, workers, preload, env):
+    port = free_port()
+    env = dict(env, GUNICORN_PRELOAD="1" if preload else "0")
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", os.path.join(REPO_DIR, "gunicorn.conf.py"),
+         "--chdir", directory, "--pythonpath", REPO_DIR, "--workers", str(workers),
+         "--bind", f"127.0.0.1:{port}", "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}/check_blacklist/0"
+        request = urllib.request.Request(url, headers={"X-API-Key": BENCH_API_KEY})
+        deadline = time.time() + 120
+        first_response = None
+        while True:
+            try:
+                urllib.request.urlopen(request, timeout=5).read()
+                first_response = first_response or time.perf_counter() - start
+                pids = worker_pids(process.pid)
+                if len(pids) >= workers:
+                    break
+            except (OSError, urllib.error.URLError):
+                pass
+            if time.time() > deadline:
+                raise RuntimeError("gunicorn did not start")
+            time.sleep(0.05)
+        # New connections spread over the workers until each has served (and loaded) once
+        for _ in range(workers * 20):
+            urllib.request.urlopen(request, timeout=30).read()
+        all_ready = time.perf_counter() - start
+        memory = [memory_kb(pid) for pid in worker_pids(process.pid)]
+        return {
+            "first_response_seconds": first_response,
+            "all_workers_ready_seconds": all_ready,
+            "worker_rss_kb": sum(m["rss"] for m in memory) / len(memory),
+            "worker_pss_kb": sum(m["pss"] for m in memory) / len(memory),
+            "worker_private_kb": sum(m["private"] for m in memory) / len(memory),
+            "master": memory_kb(process.pid),
+            "workers": len(memory),
+        }
+    finally:
+        process.terminate()
+        process.wait(10)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bans", type=int, default=100000)
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--output", help="write JSON results here")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    args = parser.parse_args()
+
+    env = dict(os.environ, RATELIMIT_ENABLED="0")
+    report = {"bans": args.bans, "workers": args.workers, "results": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        write_dataset(directory, args.bans, args.keys)
+        report["results"]["import_seconds"] = import_seconds(directory, env)
+        for mode, preload in (("per_worker", False), ("preload", True)):
+            report["results"][mode] = run_gunicorn(directory, args.workers, preload, env)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        for mode in ("per_worker", "preload"):
+            for metric in ("all_workers_ready_seconds", "worker_pss_kb", "worker_private_kb"):
+                before = baseline.get(mode, {}).get(metric)
+                after = report["results"][mode][metric]
+                if before:
+                    print(f"{mode:<11} {metric:<26} {before:12.2f} -> {after:12.2f} ({(after - before) / before * 100:+.1f}%)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
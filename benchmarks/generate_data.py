@@ -0,0 +1,81 @@
+# Writes synthetic data/banned_users.json and data/api_keys.json files shaped
+# like the real ones:
+#
+#   python benchmarks/generate_data.py /tmp/bench-100k --bans 100000 --keys 100000
+import argparse
+import json
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+
+BENCH_SEED = 1234
+# Keys the benchmarks authenticate with; the admin one belongs to an AUTHORIZED_USERS id
+BENCH_API_KEY = "00000000-0000-4000-8000-000000000001"
+BENCH_ADMIN_KEY = "00000000-0000-4000-8000-000000000002"
+BENCH_ADMIN_USER = "987323487343493191"
+
+
+def discord_id(rng):
+    return str(rng.randrange(10 ** 17, 10 ** 19))
+
+
+def generate_bans(count, seed=BENCH_SEED):
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    bans = {}
+    while len(bans) < count:
+        name = f"player_{len(bans)}"
+        mc_info = {}
+        kind = rng.random()
+        if kind < 0.6:
+            mc_info = {"minecraft_username": name, "minecraft_uuid": uuid.UUID(int=rng.getrandbits(128)).hex}
+        elif kind < 0.7:
+            # Legacy records written by older bots
+            mc_info = {"username": name, "uuid": uuid.UUID(int=rng.getrandbits(128)).hex}
+        bans[discord_id(rng)] = {
+            "reason": f"Synthetic ban {len(bans)}: " + rng.choice(["griefing", "cheating", "spam", "harassment"]),
+            "timestamp": (start + timedelta(seconds=rng.randrange(10 ** 8))).isoformat(),
+            "display_name": name,
+            "mc_info": mc_info
+        }
+    return bans
+
+
+def generate_keys(count, seed=BENCH_SEED):
+    rng = random.Random(seed + 1)
+    now = datetime.utcnow()
+    keys = [
+        {"key": BENCH_API_KEY, "user_id": "1", "created_at": now.isoformat(), "role_created": False, "expiry": None},
+        {"key": BENCH_ADMIN_KEY, "user_id": BENCH_ADMIN_USER, "created_at": now.isoformat(), "role_created": True, "expiry": None},
+    ]
+    for _ in range(max(count - len(keys), 0)):
+        expiry = None if rng.random() < 0.8 else (now + timedelta(days=rng.randrange(-30, 365))).isoformat()
+        keys.append({
+            "key": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            "user_id": discord_id(rng),
+            "created_at": now.isoformat(),
+            "role_created": False,
+            "expiry": expiry
+        })
+    return keys
+
+
+def write_dataset(directory, bans, keys):
+    data_dir = os.path.join(directory, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    ban_data = generate_bans(bans)
+    with open(os.path.join(data_dir, "banned_users.json"), "w") as f:
+        json.dump(ban_data, f, indent=4)
+    with open(os.path.join(data_dir, "api_keys.json"), "w") as f:
+        json.dump({"keys": generate_keys(keys)}, f, indent=4)
+    return ban_data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory")
+    parser.add_argument("--bans", type=int, default=1000)
+    parser.add_argument("--keys", type=int, default=1000)
+    args = parser.parse_args()
+    write_dataset(args.directory, args.bans, args.keys)
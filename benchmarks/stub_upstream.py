@@ -0,0 +1,98 @@
+# Local stand-in for the Mojang and Discord APIs, so resolution code can be
+# exercised without network access:
+#
+#   python benchmarks/stub_upstream.py --port 8081 --delay 0.05
+#   MOJANG_API_URL=http://127.0.0.1:8081 DISCORD_API_URL=http://127.0.0.1:8081/api/v10 ...
+#
+# Usernames map deterministically to UUIDs; names starting with "unknown" do
+# not exist (204) and neither do ones starting with "missing" (404). Discord
+# IDs exist when they are snowflake-sized. --fail-status makes every request
+# fail with that status instead (e.g. 429 or 500).
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_uuid(username):
+    return hashlib.md5(username.lower().encode()).hexdigest()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+    fail_status = None
+    hits = 0
+    hits_lock = threading.Lock()
+
+    def _count(self):
+        # Counted per server (serve() gives each its own handler class)
+        with StubHandler.hits_lock:
+            type(self).hits += 1
+        if self.delay:
+            time.sleep(self.delay)
+
+    def _send_json(self, status, payload=None):
+        body = b"" if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._count()
+        if self.fail_status:
+            return self._send_json(self.fail_status, {"errorMessage": "stub failure"})
+        if self.path.startswith("/users/profiles/minecraft/"):
+            username = self.path.rsplit("/", 1)[1]
+            if username.lower().startswith("unknown"):
+                return self._send_json(204)
+            if username.lower().startswith("missing"):
+                return self._send_json(404, {"errorMessage": f"Couldn't find any profile with name {username}"})
+            return self._send_json(200, {"id": fake_uuid(username), "name": username})
+        if self.path.startswith("/api/v10/users/"):
+            user_id = self.path.rsplit("/", 1)[1]
+            if user_id.isdigit() and len(user_id) > 15:
+                return self._send_json(200, {"id": user_id, "username": f"user{user_id[-4:]}"})
+            return self._send_json(404, {"message": "Unknown User"})
+        if self.path == "/hits":
+            return self._send_json(200, {"hits": type(self).hits})
+        self._send_json(404, {})
+
+    def do_POST(self):
+        self._count()
+        if self.fail_status:
+            return self._send_json(self.fail_status, {"errorMessage": "stub failure"})
+        if self.path == "/profiles/minecraft":
+            names = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"[]")
+            if len(names) > 10:
+                return self._send_json(400, {"errorMessage": "Not more that 10 profile name per call is allowed."})
+            return self._send_json(200, [
+                {"id": fake_uuid(name), "name": name} for name in names
+                if not name.lower().startswith(("unknown", "missing"))
+            ])
+        self._send_json(404, {})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=0, delay=0.0, fail_status=None):
+    # Starts the stub in a daemon thread and returns the server (server_address
+    # has the bound port, RequestHandlerClass.hits the requests served)
+    handler = type("Handler", (StubHandler,), {"delay": delay, "fail_status": fail_status, "hits": 0})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to sleep per request")
+    parser.add_argument("--fail-status", type=int, help="answer every request with this status")
+    args = parser.parse_args()
+    handler = type("Handler", (StubHandler,), {"delay": args.delay, "fail_status": args.fail_status})
+    ThreadingHTTPServer(("127.0.0.1", args.port), handler).serve_forever()
@@ -1,73 +1,146 @@
-import json
+import asyncio
+import logging
+import os
 from datetime import datetime
-import requests
 import aiohttp
+import metrics
+import mojang
+from identifiers import canonical, is_uuid
+from stores import ban_store
+from ttl_cache import TTLCache
 
-BANNED_USERS_FILE = "data/banned_users.json"
+logger = logging.getLogger(__name__)
+
+DISCORD_API_URL = os.getenv("DISCORD_API_URL", "https://discord.com/api/v10")
+DISCORD_TIMEOUT = aiohttp.ClientTimeout(connect=float(os.getenv("DISCORD_CONNECT_TIMEOUT", 2)),
+                                        sock_read=float(os.getenv("DISCORD_READ_TIMEOUT", 3)))
+# Existing IDs are cached long; unknown ones only briefly, like Mojang's negative cache
+DISCORD_ID_CACHE_TTL = float(os.getenv("DISCORD_ID_CACHE_TTL", 3600))
+DISCORD_INVALID_ID_TTL = float(os.getenv("DISCORD_INVALID_ID_TTL", 300))
+DISCORD_ID_CACHE_SIZE = int(os.getenv("DISCORD_ID_CACHE_SIZE", 10000))
 AUTHORIZED_USERS = [987323487343493191, 1088268266499231764, 726721909374320640, 710863981039845467, 1151136371164065904]
 
 def get_uuid(username):
-    response = requests.get(f"https://api.mojang.com/users/profiles/minecraft/{username}")
-    if response.status_code == 200:
-        data = response.json()
-        return data['id']
-    return None
+    return mojang.get_uuid(username)
 
 def load_banned_users():
-    try:
-        with open(BANNED_USERS_FILE, "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
-
-def save_banned_users(banned_users):
-    with open(BANNED_USERS_FILE, "w") as f:
-        json.dump(banned_users, f, indent=4)
+    return ban_store.snapshot()
 
 def blacklist_user(auth_id, user_identifier, reason):
     if auth_id not in AUTHORIZED_USERS:
         return {"error": "Unauthorized"}, 403
     
-    uuid = user_identifier if len(user_identifier) == 32 else get_uuid(user_identifier)
+    uuid = canonical(user_identifier)
+    if not is_uuid(uuid):
+        uuid = get_uuid(user_identifier)
     if not uuid:
         return {"error": "Invalid username or UUID"}, 400
     
-    banned_users = load_banned_users()
-    banned_users[uuid] = {
+    ban_store.ban(uuid, {
         "reason": reason,
         "timestamp": datetime.utcnow().isoformat(),
-        "username": user_identifier if len(user_identifier) < 32 else None
-    }
-    save_banned_users(banned_users)
+        "username": None if is_uuid(canonical(user_identifier)) else user_identifier
+    })
     return {"message": f"User {user_identifier} blacklisted successfully"}
 
 
+# Discord user ID -> True (exists) / False (404); errors are not cached
+_discord_ids = TTLCache(maxsize=DISCORD_ID_CACHE_SIZE, ttl=DISCORD_ID_CACHE_TTL)
+# In-flight lookups, so concurrent checks for one player share a single call
+_inflight = {}
+_session = None
+_session_owner = None
+
+
+def get_session():
+    # One pooled session per process and event loop, created on first use
+    global _session, _session_owner
+    owner = (os.getpid(), asyncio.get_running_loop())
+    if _session is None or _session.closed or _session_owner != owner:
+        _session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300))
+        _session_owner = owner
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+async def _coalesced(key, make):
+    key = (asyncio.get_running_loop(), key)
+    task = _inflight.get(key)
+    if task is None:
+        task = _inflight[key] = asyncio.ensure_future(make())
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # A cancelled caller must not cancel the lookup other callers are waiting on
+    return await asyncio.shield(task)
+
+
+async def _fetch_discord_user(user_id):
+    try:
+        with metrics.timer("outbound_request_seconds", service="discord", endpoint="user"):
+            async with get_session().get(f"{DISCORD_API_URL}/users/{user_id}", timeout=DISCORD_TIMEOUT) as response:
+                status = response.status
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning(f"Discord lookup for {user_id} failed: {str(e)}")
+        return None
+    if status == 200:
+        _discord_ids.set(user_id, True)
+        return True
+    if status == 404:
+        _discord_ids.set(user_id, False, ttl=DISCORD_INVALID_ID_TTL)
+        return False
+    return None
+
+
+async def verify_discord_id(user_id):
+    # True if the user exists, False if Discord says it doesn't, None if it couldn't tell
+    cached = _discord_ids.get(user_id)
+    metrics.cache_result("discord_ids", cached is not None)
+    if cached is not None:
+        return cached
+    return await _coalesced(("discord", user_id), lambda: _fetch_discord_user(user_id))
+
+
+async def get_uuid_async(username):
+    # Non-blocking Mojang lookup on the pooled session, sharing the resolver's cache
+    return await _coalesced(("mojang", username.lower()),
+                            lambda: mojang.get_uuid_async(username, get_session()))
+
+
 async def check_blacklist(user_identifier):
+    # Any stored identifier (Discord ID, UUID in any spelling, username) answers locally
+    match = ban_store.lookup(user_identifier)
+    if match is not None:
+        return {"blacklisted": True, "reason": match[1]["reason"]}
+
     # Check if it's a potential Discord user ID (long integer)
     if user_identifier.isdigit() and len(user_identifier) > 15:
         # Verify the Discord ID by querying the API
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"https://discord.com/api/v10/users/{user_identifier}") as response:
-                if response.status == 200:
-                    # Valid Discord ID
-                    uuid = user_identifier
-                elif response.status == 404:
-                    return {"error": "Invalid Discord user ID"}, 400
-                else:
-                    return {"error": "Unable to verify Discord user ID"}, 500
-    elif len(user_identifier) == 32 and all(c in '0123456789abcdef' for c in user_identifier):
+        verified = await verify_discord_id(user_identifier)
+        if verified:
+            # Valid Discord ID
+            uuid = user_identifier
+        elif verified is False:
+            return {"error": "Invalid Discord user ID"}, 400
+        else:
+            return {"error": "Unable to verify Discord user ID"}, 500
+    elif is_uuid(canonical(user_identifier)):
         # It's a Minecraft UUID
-        uuid = user_identifier
+        uuid = canonical(user_identifier)
     else:
         # Assume it's a Minecraft username and convert to UUID
-        uuid = get_uuid(user_identifier)
+        uuid = await get_uuid_async(user_identifier)
     
     if not uuid:
         return {"error": "Invalid identifier"}, 400
     
-    banned_users = load_banned_users()
-    if uuid in banned_users:
-        return {"blacklisted": True, "reason": banned_users[uuid]["reason"]}
+    match = ban_store.lookup(uuid)
+    if match is not None:
+        return {"blacklisted": True, "reason": match[1]["reason"]}
     return {"blacklisted": False}
 
 def get_banned_users():
@@ -0,0 +1,76 @@
+import hashlib
+import math
+import struct
+
+# Serialized layout, so clients can run the same pre-check locally:
+#   b"BLM1" | hash_count: u8 | size_bits: u64 (big-endian) | bit array
+# For an identifier in canonical form (identifiers.canonical: undashed lower-case
+# UUIDs, lower-case usernames), d = blake2b(identifier.encode("utf-8"), digest_size=16),
+# h1 = int(d[:8]) and h2 = int(d[8:]) (big-endian), and the k bit positions are
+# (h1 + i * h2) % size_bits for i in range(hash_count). Bit j lives in byte
+# j // 8 under mask 1 << (j % 8). Any unset bit means "definitely not present".
+MAGIC = b"BLM1"
+HEADER = struct.Struct(">4sBQ")
+
+
+class BloomFilter:
+    def __init__(self, size_bits, hash_count, bits=None):
+        self.size_bits = max(size_bits, 8)
+        self.hash_count = max(hash_count, 1)
+        self.bits = bits if bits is not None else bytearray((self.size_bits + 7) // 8)
+        self.count = 0
+
+    @classmethod
+    def for_capacity(cls, capacity, fp_rate):
+        # Optimal m and k for `capacity` items at the target false-positive rate
+        capacity = max(capacity, 1)
+        size_bits = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+        hash_count = round(size_bits / capacity * math.log(2))
+        return cls(size_bits, hash_count)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big")
+        size = self.size_bits
+        return [(h1 + i * h2) % size for i in range(self.hash_count)]
+
+    def add(self, item):
+        bits = self.bits
+        for position in self._positions(item):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def memory_bytes(self):
+        return len(self.bits)
+
+    def expected_fp_rate(self, count=None):
+        count = self.count if count is None else count
+        return (1 - math.exp(-self.hash_count * count / self.size_bits)) ** self.hash_count
+
+    def stats(self):
+        return {
+            "size_bits": self.size_bits,
+            "hash_count": self.hash_count,
+            "items": self.count,
+            "memory_bytes": self.memory_bytes,
+            "expected_fp_rate": self.expected_fp_rate()
+        }
+
+    def to_bytes(self):
+        return HEADER.pack(MAGIC, self.hash_count, self.size_bits) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, hash_count, size_bits = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a serialized BloomFilter")
+        return cls(size_bits, hash_count, bytearray(data[HEADER.size:]))
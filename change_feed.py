@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from storage_utils import file_lock, file_signature, truncate_partial_line
+
+logger = logging.getLogger(__name__)
+
+# Changes kept for consumers to catch up from; older ones mean a full resync
+CHANGE_FEED_RETAIN = int(os.getenv("CHANGE_FEED_RETAIN", 10000))
+CHANGE_FEED_PAGE_SIZE = 1000
+CHANGE_STREAM_POLL_SECONDS = 1.0
+CHANGE_STREAM_HEARTBEAT_SECONDS = 15.0
+
+
+class ChangeFeed:
+    # Append-only, monotonically numbered log of ban/unban events shared by all
+    # workers through a JSON-lines file. Each record carries a `seq`; consumers
+    # keep the last seq they applied and ask for everything after it. Only the
+    # newest `retain` records are kept (in memory and on disk), so a consumer
+    # that fell further behind is told to reset and re-fetch the full list.
+
+    def __init__(self, file_path, retain=CHANGE_FEED_RETAIN):
+        self.file_path = file_path
+        self.lock_path = f"{file_path}.lock"
+        self.retain = retain
+        self._lock = threading.RLock()
+        self._inode = None
+        self._offset = 0
+        self._records = deque(maxlen=retain)
+        self._lines_on_disk = 0
+        self._lock_held = False
+
+    @property
+    def latest(self):
+        self.refresh()
+        return self._records[-1]["seq"] if self._records else 0
+
+    def _read(self, offset):
+        try:
+            with open(self.file_path, "rb") as f:
+                inode = os.fstat(f.fileno()).st_ino
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return None, 0
+        # A half-written last line is left for the next append to cut off;
+        # complete lines that don't parse are logged and skipped
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.error(f"Skipping unreadable record in {self.file_path}: {line[:200]!r}")
+                continue
+            self._records.append(record)
+            self._lines_on_disk += 1
+        return inode, offset + end
+
+    def refresh(self):
+        signature = file_signature(self.file_path)
+        inode, size = (signature[0], signature[2]) if signature else (None, 0)
+        if inode == self._inode and size == self._offset:
+            return
+        with self._lock:
+            if inode != self._inode or size < self._offset:
+                # Trimmed by another worker; start over from the new file
+                self._records.clear()
+                self._lines_on_disk = 0
+                self._inode, self._offset = self._read(0)
+            else:
+                self._inode, self._offset = self._read(self._offset)
+
+    @contextmanager
+    def exclusive(self):
+        # Holds the feed's write lock, reentrantly within this process, so a
+        # store can read what to publish and publish it without another
+        # worker's changes landing in between
+        with self._lock:
+            if self._lock_held:
+                yield
+                return
+            with file_lock(self.lock_path):
+                self._lock_held = True
+                try:
+                    yield
+                finally:
+                    self._lock_held = False
+
+    def append(self, op, user_id, details=None):
+        return self.append_many([(op, user_id, details)])
+
+    def append_many(self, changes):
+        # changes: (op, user_id, details) tuples, written with a single fsync.
+        # Returns the seq of the last one.
+        with self._lock:
+            with self.exclusive():
+                # Everything other workers appended is read first, so seq stays monotonic
+                self.refresh()
+                seq = self._records[-1]["seq"] if self._records else 0
+                at = datetime.utcnow().isoformat()
+                lines = []
+                for op, user_id, details in changes:
+                    seq += 1
+                    record = {"seq": seq, "op": op, "user_id": user_id, "details": details, "at": at}
+                    lines.append(json.dumps(record, separators=(",", ":")) + "\n")
+                truncate_partial_line(self.file_path)
+                with open(self.file_path, "a") as f:
+                    f.write("".join(lines))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.refresh()
+                if self._lines_on_disk > 2 * self.retain:
+                    self._trim()
+            return seq
+
+    def _trim(self):
+        # Called with the file lock held; rewrites only the retained tail
+        tmp_path = f"{self.file_path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            for record in self._records:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.file_path)
+        self._inode = None
+        self.refresh()
+
+    def since(self, seq, limit=CHANGE_FEED_PAGE_SIZE):
+        # Returns (changes after seq, latest seq, reset). reset means the
+        # consumer's seq predates the retained window and it must resync fully.
+        self.refresh()
+        records = list(self._records)
+        latest = records[-1]["seq"] if records else 0
+        if seq > latest:
+            return [], latest, True
+        if records and seq < records[0]["seq"] - 1:
+            return [], latest, True
+        # seqs are contiguous, so the start position follows from the first one
+        start = max(seq - records[0]["seq"] + 1, 0) if records else 0
+        return records[start:start + limit], latest, False
+
+
+def sse_event(record):
+    # Server-Sent Events framing; the seq doubles as the event id so a reconnecting
+    # EventSource resumes from Last-Event-ID
+    return f"id: {record['seq']}\nevent: {record['op']}\ndata: {json.dumps(record)}\n\n"
+
+
+def sse_reset(latest):
+    return f"id: {latest}\nevent: reset\ndata: {json.dumps({'seq': latest})}\n\n"
@@ -0,0 +1,95 @@
+import os
+import zlib
+
+# Response compression negotiated from Accept-Encoding. gzip is always
+# available; br and zstd are offered when the brotli / zstandard packages are
+# installed. Among the encodings a client accepts with the highest q-value, the
+# first of COMPRESSION_PREFERENCE wins: zstd and br compress JSON and HTML
+# better than gzip at a similar or lower CPU cost.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bodies smaller than this go out as is: the saving doesn't pay for the CPU
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+COMPRESSION_LEVELS = {
+    "zstd": int(os.getenv("COMPRESSION_LEVEL_ZSTD", 6)),
+    "br": int(os.getenv("COMPRESSION_LEVEL_BR", 5)),
+    "gzip": int(os.getenv("COMPRESSION_LEVEL_GZIP", 6)),
+}
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+# Server-sent events must reach the client as each one is written, but the
+# compressors hold data back until they have a block's worth
+UNCOMPRESSED_TYPES = ("text/event-stream",)
+COMPRESSION_PREFERENCE = tuple(encoding for encoding, available in
+                               (("zstd", zstandard), ("br", brotli), ("gzip", True)) if available)
+
+
+def compressible(mimetype):
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES) and not mimetype.startswith(UNCOMPRESSED_TYPES)
+
+
+def negotiate(accept_encoding):
+    # The encoding to use for a client sending `accept_encoding`, or None
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    wildcard = accepted.get("*", 0.0)
+    best, best_q = None, 0.0
+    for encoding in COMPRESSION_PREFERENCE:
+        q = accepted.get(encoding, accepted.get("x-gzip", wildcard) if encoding == "gzip" else wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body, encoding):
+    level = COMPRESSION_LEVELS[encoding]
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip framing
+    return compressor.compress(body) + compressor.flush()
+
+
+class _BrotliStream:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def compress_stream(chunks, encoding):
+    # Compresses a streamed body (str or bytes chunks) as it is produced
+    level = COMPRESSION_LEVELS[encoding]
+    if encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    elif encoding == "br":
+        compressor = _BrotliStream(level)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,117 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+import metrics
+from stores import api_key_store, ban_store, open_limiter_storage
+
+# Background removal of everything with an expiry: time-limited bans, expired
+# API keys and rate limit buckets nobody is hitting any more. Reads already
+# ignore expired items, so this is about keeping the stores (and the indexes,
+# filters and caches built over them) sized to live data.
+#
+# Every worker starts a sweeper, but only the one holding SWEEPER_LOCK_FILE
+# sweeps; the lock is held for the life of the process, so another worker
+# takes over when the leader exits. The leader sleeps until the earliest known
+# ban or key expiry, at most SWEEP_INTERVAL seconds, and removes everything
+# due at once: expired bans go out as a single unban append (and change feed
+# events), keys and buckets as one delete each. SWEEP_INTERVAL=0 disables it.
+
+logger = logging.getLogger(__name__)
+
+SWEEP_INTERVAL = float(os.getenv("SWEEP_INTERVAL", 30))
+SWEEPER_LOCK_FILE = "data/sweeper.lock"
+# Floor between sweeps, so an expiry that can't be removed doesn't spin the loop
+SWEEP_MIN_DELAY = 1.0
+
+
+class ExpirySweeper:
+    def __init__(self, ban_store, api_key_store, limiter_storage=None, interval=SWEEP_INTERVAL,
+                 lock_path=SWEEPER_LOCK_FILE, on_sweep=None):
+        self.ban_store = ban_store
+        self.api_key_store = api_key_store
+        self.limiter_storage = limiter_storage
+        self.interval = interval
+        self.lock_path = lock_path
+        # Called with sweep()'s counts after anything was removed (e.g. to drop response caches)
+        self.on_sweep = on_sweep
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _lead(self):
+        # True once this process holds the leader lock
+        if self._lock_file is not None:
+            return True
+        os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+        f = open(self.lock_path, "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        self._lock_file = f
+        logger.info(f"Expiry sweeper running in process {os.getpid()}")
+        return True
+
+    def sweep(self, now=None):
+        # Removes everything expired by `now`; returns {kind: number removed}
+        now = time.time() if now is None else now
+        expired = {
+            "ban": len(self.ban_store.expire(now)),
+            "api_key": self.api_key_store.purge_expired(now),
+            "rate_limit": self.limiter_storage.purge_expired(now) if self.limiter_storage is not None else 0,
+        }
+        for kind, count in expired.items():
+            if count:
+                metrics.inc("expired_total", count, kind=kind)
+        if self.on_sweep is not None and any(expired.values()):
+            self.on_sweep(expired)
+        return expired
+
+    def _delay(self):
+        now = time.time()
+        deadline = now + self.interval
+        for next_expiry in (self.ban_store.next_expiry(), self.api_key_store.next_expiry()):
+            if next_expiry is not None:
+                deadline = min(deadline, next_expiry)
+        return max(SWEEP_MIN_DELAY, deadline - now)
+
+    def run(self):
+        while not self._stop.is_set():
+            delay = self.interval
+            if self._lead():
+                try:
+                    self.sweep()
+                    delay = self._delay()
+                except Exception:
+                    logger.exception("Expiry sweep failed")
+            self._stop.wait(delay)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="expiry-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._lock_file is not None:
+            self._lock_file.close()  # Releases the lock
+            self._lock_file = None
+
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def start(on_sweep=None):
+    # Starts this process's sweeper once; call it in each worker, after the
+    # fork (the thread and the lock must not be inherited)
+    global _sweeper
+    if SWEEP_INTERVAL <= 0:
+        return None
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = ExpirySweeper(ban_store, api_key_store, open_limiter_storage(), on_sweep=on_sweep)
+            _sweeper.start()
+    return _sweeper
@@ -0,0 +1,34 @@
+import json
+import os
+
+# JSON encoding for response bodies. orjson, when installed, serializes several
+# times faster than the stdlib and returns bytes directly; JSON_ENCODER=json
+# forces the stdlib (e.g. to compare output). Both produce compact JSON with
+# the same values, so responses don't depend on which one is in use.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+if os.getenv("JSON_ENCODER", "orjson") == "json":
+    orjson = None
+
+# Types the stdlib also refuses are handed to `default`, so callers keep their
+# own fallbacks (e.g. Flask's for dates); dict keys needn't be strings
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                  | orjson.OPT_PASSTHROUGH_DATACLASS) if orjson else 0
+
+
+def dumps(obj, default=None, sort_keys=False):
+    # UTF-8 encoded JSON
+    if orjson is not None:
+        return orjson.dumps(obj, default=default,
+                            option=ORJSON_OPTIONS | (orjson.OPT_SORT_KEYS if sort_keys else 0))
+    return json.dumps(obj, default=default, sort_keys=sort_keys, ensure_ascii=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def loads(data):
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError (a ValueError)
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
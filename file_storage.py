@@ -4,12 +4,13 @@ from limits.storage import Storage
 from limits.util import parse_many
 from datetime import datetime, timedelta
 from limits.errors import ConfigurationError
+import metrics
 
 class FileStorage(Storage):
     def __init__(self, uri, **options):
         self.file_path = options.get("file_path", "data/rate_limits/limiter.json")
-        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
-        self.storage = self._load()
+        # Every operation re-reads the file, so nothing is loaded up front
+        self.storage = {}
 
     @property
     def base_exceptions(self):
@@ -23,10 +24,15 @@ class FileStorage(Storage):
             return {}
 
     def _save(self):
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
         with open(self.file_path, "w") as f:
             json.dump(self.storage, f)
 
     def get(self, key):
+        with metrics.timer("limiter_storage_seconds", storage="file", op="get"):
+            return self._get(key)
+
+    def _get(self, key):
         self.storage = self._load()
         now = datetime.now().timestamp()
         if key in self.storage:
@@ -39,6 +45,10 @@ class FileStorage(Storage):
         return 0
 
     def incr(self, key, expiry, elastic_expiry=False):
+        with metrics.timer("limiter_storage_seconds", storage="file", op="incr"):
+            return self._incr(key, expiry, elastic_expiry)
+
+    def _incr(self, key, expiry, elastic_expiry=False):
         self.storage = self._load()
         now = datetime.now().timestamp()
         
@@ -67,6 +77,18 @@ class FileStorage(Storage):
             del self.storage[key]
             self._save()
 
+    def purge_expired(self, now=None):
+        # Drops every expired bucket with a single write, instead of leaving
+        # each one until its key is next read. Returns how many were dropped.
+        self.storage = self._load()
+        now = datetime.now().timestamp() if now is None else now
+        expired = [key for key, (expiry, _) in self.storage.items() if expiry <= now]
+        for key in expired:
+            del self.storage[key]
+        if expired:
+            self._save()
+        return len(expired)
+
     def get_expiry(self, key):
         self.storage = self._load()
         if key in self.storage:
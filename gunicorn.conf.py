@@ -1,5 +1,49 @@
+import os
+
 bind = "0.0.0.0:5000"
 workers = 4
 loglevel = "debug"
 accesslog = "access.log"
 errorlog = "error.log"
+
+# "sync" serves the Flask app (wsgi:app). Setting
+# GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker serves the async
+# read-only endpoints from asgi:app instead.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+wsgi_app = "asgi:app" if "uvicorn" in worker_class.lower() else "wsgi:app"
+# Import the app once in the master and fork workers from it: startup work and
+# read-mostly data (ban indexes, API keys) are then shared copy-on-write, and
+# every worker signs sessions with the same key. GUNICORN_PRELOAD=0 restores
+# per-worker imports, e.g. for code reloading.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
+
+
+def on_starting(server):
+    # Per-worker metric files from a previous run would otherwise be summed into /metrics
+    import metrics
+    metrics.clear()
+
+
+def when_ready(server):
+    if preload_app and wsgi_app == "wsgi:app":
+        import api
+        api.warm_up()
+
+
+def pre_fork(server, worker):
+    # Keep the preloaded objects out of the collector's reach, so collections in
+    # a worker don't write to (and un-share) their pages. Per-process resources
+    # (SQLite connections, HTTP sessions, metrics) notice the new pid and reopen
+    # in the worker on first use.
+    import gc
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # One expiry sweeper per worker; they elect a leader between them
+    if wsgi_app == "wsgi:app":
+        import api
+        api.start_sweeper()
+    else:
+        import expiry_sweeper
+        expiry_sweeper.start()
@@ -0,0 +1,50 @@
+import re
+
+# One canonical spelling per identifier, so every form a client might send
+# (dashed or upper-case UUIDs, Discord mentions, any-case usernames) matches
+# the same index key. The three kinds cannot collide: UUIDs are 32 hex
+# characters, Discord snowflakes are 17+ digits and Minecraft usernames are at
+# most 16 characters.
+
+UUID_HEX = re.compile(r"^[0-9a-f]{32}$")
+DISCORD_MENTION = re.compile(r"^<@!?(\d+)>$")
+MINECRAFT_USERNAME = re.compile(r"^[A-Za-z0-9_]{3,16}$")
+
+# mc_info fields find_by() can match on
+LOOKUP_FIELDS = ("minecraft_uuid", "uuid")
+# Fields of a ban entry that identify the banned player, besides its key
+MC_INFO_ALIAS_FIELDS = ("minecraft_uuid", "uuid", "minecraft_username", "username")
+ENTRY_ALIAS_FIELDS = ("username",)  # blacklist/blacklist.py entries
+
+
+def canonical(identifier):
+    # Undashed lower-case UUIDs, bare snowflakes, lower-case usernames
+    if identifier is None:
+        return None
+    value = str(identifier).strip()
+    mention = DISCORD_MENTION.match(value)
+    if mention:
+        return mention.group(1)
+    undashed = value.replace("-", "").lower()
+    if len(value) in (32, 36) and UUID_HEX.match(undashed):
+        return undashed
+    return value.lower() or None
+
+
+def is_uuid(identifier):
+    return bool(identifier) and bool(UUID_HEX.match(identifier))
+
+
+def entry_aliases(user_id, details):
+    # Every canonical identifier a ban entry can be found by, the key first
+    mc_info = details.get("mc_info") or {}
+    values = [user_id]
+    values += [mc_info.get(field) for field in MC_INFO_ALIAS_FIELDS]
+    values += [details.get(field) for field in ENTRY_ALIAS_FIELDS]
+    aliases = (canonical(value) for value in values if value)
+    return list(dict.fromkeys(alias for alias in aliases if alias))
+
+
+def field_alias(details, field):
+    # Canonical value of one mc_info field, for find_by
+    return canonical((details.get("mc_info") or {}).get(field))
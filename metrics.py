@@ -0,0 +1,160 @@
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-process counters and latency histograms, aggregated across gunicorn
+# workers for the /metrics endpoint. Each process keeps its numbers in memory
+# and writes them to METRICS_DIR/<pid>.json at most every METRICS_FLUSH_SECONDS;
+# collect() sums every process's file. Files of exited workers are kept, so
+# counters stay monotonic across worker restarts.
+
+METRICS_DIR = os.getenv("METRICS_DIR", "data/metrics")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", 1))
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_pid = os.getpid()
+_last_flush = 0.0
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _check_fork():
+    # A forked worker starts from zero instead of re-reporting the parent's numbers
+    global _pid, _last_flush
+    if os.getpid() != _pid:
+        _counters.clear()
+        _histograms.clear()
+        _pid = os.getpid()
+        _last_flush = 0.0
+
+
+def inc(name, amount=1, **labels):
+    with _lock:
+        _check_fork()
+        key = (name, _labels(labels))
+        _counters[key] = _counters.get(key, 0) + amount
+    _maybe_flush()
+
+
+def observe(name, value, **labels):
+    with _lock:
+        _check_fork()
+        key = (name, _labels(labels))
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+                break
+        histogram[-2] += value
+        histogram[-1] += 1
+    _maybe_flush()
+
+
+@contextmanager
+def timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def cache_result(cache, hit):
+    inc("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def _maybe_flush():
+    if time.monotonic() - _last_flush >= METRICS_FLUSH_SECONDS:
+        flush()
+
+
+def flush():
+    global _last_flush
+    with _lock:
+        _check_fork()
+        _last_flush = time.monotonic()
+        state = {
+            "counters": [[name, labels, value] for (name, labels), value in _counters.items()],
+            "histograms": [[name, labels, values] for (name, labels), values in _histograms.items()],
+        }
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"{_pid}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(f"{path}.tmp", path)
+    except OSError:
+        # Metrics must never take a request down
+        pass
+
+
+def collect():
+    flush()
+    counters = {}
+    histograms = {}
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in state["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in state["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+    return counters, histograms
+
+
+def clear():
+    # Called once by the gunicorn master at startup
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+def render():
+    # Prometheus text exposition format
+    counters, histograms = collect()
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {name} counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, values):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', str(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {values[-1]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {values[-2]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+    return "\n".join(lines) + "\n"
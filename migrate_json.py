@@ -0,0 +1,33 @@
+import argparse
+from api_key_store import ApiKeyStore
+from ban_store import BanStore
+from sqlite_store import SQLiteApiKeyStore, SQLiteBanStore
+from stores import API_KEYS_FILE, BANNED_USERS_FILE, DATABASE_FILE
+
+# One-off import of the JSON data files into the SQLite backend:
+#
+#   python migrate_json.py [--db data/idotheapi.db]
+#
+# then start the app with STORAGE_BACKEND=sqlite. The ban journal is folded in
+# through BanStore, so bans not yet compacted into the snapshot are included.
+# Re-running is safe: bans are upserted by user_id and keys by digest.
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bans", default=BANNED_USERS_FILE)
+    parser.add_argument("--api-keys", default=API_KEYS_FILE)
+    parser.add_argument("--db", default=DATABASE_FILE)
+    args = parser.parse_args()
+
+    bans = BanStore(args.bans, compact_every=0).snapshot()
+    SQLiteBanStore(args.db).ban_many(bans.items())
+    print(f"Imported {len(bans)} bans into {args.db}")
+
+    keys = ApiKeyStore(args.api_keys).all_keys()
+    SQLiteApiKeyStore(args.db).add_keys(keys)
+    print(f"Imported {len(keys)} API keys into {args.db}")
+
+
+if __name__ == "__main__":
+    main()
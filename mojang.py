@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+import aiohttp
+import requests
+import metrics
+from requests.adapters import HTTPAdapter
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+MOJANG_API_URL = os.getenv("MOJANG_API_URL", "https://api.mojang.com")
+MOJANG_TIMEOUT = (float(os.getenv("MOJANG_CONNECT_TIMEOUT", 2)), float(os.getenv("MOJANG_READ_TIMEOUT", 3)))
+MOJANG_CACHE_SIZE = int(os.getenv("MOJANG_CACHE_SIZE", 10000))
+MOJANG_CACHE_TTL = float(os.getenv("MOJANG_CACHE_TTL", 3600))
+# Unknown names are cached briefly so a typo can't hammer Mojang, but a newly
+# registered or renamed account is picked up soon after
+MOJANG_NEGATIVE_TTL = float(os.getenv("MOJANG_NEGATIVE_TTL", 60))
+MOJANG_BATCH_SIZE = 10  # Mojang's limit for the bulk profiles endpoint
+_MISSING = object()
+
+
+class MojangResolver:
+    # Username -> UUID resolution with a pooled session, strict timeouts and
+    # an LRU+TTL cache. A failed or timed out call is not cached and resolves
+    # to None, so a slow Mojang can only stall a worker for MOJANG_TIMEOUT.
+
+    def __init__(self, base_url=MOJANG_API_URL, timeout=MOJANG_TIMEOUT, cache_size=MOJANG_CACHE_SIZE,
+                 ttl=MOJANG_CACHE_TTL, negative_ttl=MOJANG_NEGATIVE_TTL):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.negative_ttl = negative_ttl
+        self.cache = TTLCache(maxsize=cache_size, ttl=ttl)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=10, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _cached(self, username):
+        cached = self.cache.get(username.lower(), _MISSING)
+        metrics.cache_result("mojang", cached is not _MISSING)
+        return cached
+
+    def _remember(self, username, uuid):
+        self.cache.set(username.lower(), uuid, ttl=None if uuid else self.negative_ttl)
+
+    def get_uuid(self, username):
+        cached = self._cached(username)
+        if cached is not _MISSING:
+            return cached
+        try:
+            with metrics.timer("outbound_request_seconds", service="mojang", endpoint="profile"):
+                response = self.session.get(f"{self.base_url}/users/profiles/minecraft/{username}", timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.warning(f"Mojang lookup for {username} failed: {str(e)}")
+            return None
+        if response.status_code == 200:
+            uuid = response.json().get("id")
+        elif response.status_code in (204, 404):
+            uuid = None
+        else:
+            logger.warning(f"Mojang lookup for {username} returned {response.status_code}")
+            return None
+        self._remember(username, uuid)
+        return uuid
+
+    async def get_uuid_async(self, username, session):
+        # Same lookup on a caller-owned aiohttp session, sharing this resolver's cache
+        cached = self._cached(username)
+        if cached is not _MISSING:
+            return cached
+        timeout = aiohttp.ClientTimeout(connect=self.timeout[0], sock_read=self.timeout[1])
+        try:
+            with metrics.timer("outbound_request_seconds", service="mojang", endpoint="profile"):
+                uuid = await self._fetch_async(session, username, timeout)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Mojang lookup for {username} failed: {str(e)}")
+            return None
+        if uuid is _MISSING:
+            return None
+        self._remember(username, uuid)
+        return uuid
+
+    async def _fetch_async(self, session, username, timeout):
+        # _MISSING marks an error answer, which must not be cached
+        async with session.get(f"{self.base_url}/users/profiles/minecraft/{username}", timeout=timeout) as response:
+            if response.status == 200:
+                return (await response.json(content_type=None)).get("id")
+            if response.status in (204, 404):
+                return None
+            logger.warning(f"Mojang lookup for {username} returned {response.status}")
+            return _MISSING
+
+    def get_uuids(self, usernames):
+        # Bulk mode: cached names are answered locally, the rest go to the
+        # profiles endpoint MOJANG_BATCH_SIZE names per request. Unknown names
+        # map to None; names whose request failed (an error, a 429, a timeout)
+        # are left out, since whether they exist isn't known.
+        results = {}
+        missing = []
+        for username in dict.fromkeys(usernames):
+            cached = self._cached(username)
+            if cached is _MISSING:
+                missing.append(username)
+            else:
+                results[username] = cached
+        for start in range(0, len(missing), MOJANG_BATCH_SIZE):
+            chunk = missing[start:start + MOJANG_BATCH_SIZE]
+            try:
+                with metrics.timer("outbound_request_seconds", service="mojang", endpoint="profiles"):
+                    response = self.session.post(f"{self.base_url}/profiles/minecraft", json=chunk, timeout=self.timeout)
+                response.raise_for_status()
+                profiles = response.json()
+            except (requests.RequestException, ValueError) as e:
+                logger.warning(f"Mojang bulk lookup failed: {str(e)}")
+                continue
+            found = {profile["name"].lower(): profile["id"] for profile in profiles}
+            for username in chunk:
+                uuid = found.get(username.lower())
+                self._remember(username, uuid)
+                results[username] = uuid
+        return results
+
+
+_resolver = None
+_resolver_pid = None
+
+
+def get_resolver():
+    # One resolver per process; a pooled session must not be shared across a fork
+    global _resolver, _resolver_pid
+    if _resolver is None or _resolver_pid != os.getpid():
+        _resolver = MojangResolver()
+        _resolver_pid = os.getpid()
+    return _resolver
+
+
+def get_uuid(username):
+    return get_resolver().get_uuid(username)
+
+
+def get_uuids(usernames):
+    return get_resolver().get_uuids(usernames)
+
+
+async def get_uuid_async(username, session):
+    return await get_resolver().get_uuid_async(username, session)
@@ -0,0 +1,73 @@
+from datetime import datetime
+from storage_utils import SQLiteConnections
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS pending_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        discord_user_id TEXT NOT NULL,
+        display_name TEXT NOT NULL,
+        minecraft_username TEXT NOT NULL DEFAULT '',
+        minecraft_uuid TEXT NOT NULL DEFAULT '',
+        reason TEXT NOT NULL,
+        submitted_at TEXT NOT NULL,
+        reviewed_by TEXT,
+        reviewed_at TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS pending_requests_status ON pending_requests (status, id)",
+)
+STATUSES = ("pending", "approved", "rejected")
+MAX_PER_PAGE = 200
+
+FIELDS = ("discord_user_id", "display_name", "minecraft_username", "minecraft_uuid", "reason")
+
+
+class PendingQueue:
+    # Blacklist requests submitted from the website, persisted in SQLite so
+    # every gunicorn worker sees the same queue and it survives restarts.
+    # Memory use is one page of requests, however many are queued.
+
+    def __init__(self, path):
+        self._connections = SQLiteConnections(path, SCHEMA)
+
+    @staticmethod
+    def _row(cursor, row):
+        return {column[0]: value for column, value in zip(cursor.description, row)}
+
+    def submit(self, request_data):
+        with self._connections.transaction() as conn:
+            cursor = conn.execute(
+                f"INSERT INTO pending_requests ({', '.join(FIELDS)}, submitted_at) VALUES (?, ?, ?, ?, ?, ?)",
+                tuple(request_data.get(field) or "" for field in FIELDS) + (datetime.utcnow().isoformat(),),
+            )
+        return cursor.lastrowid
+
+    def get(self, request_id):
+        cursor = self._connections.get().execute("SELECT * FROM pending_requests WHERE id = ?", (request_id,))
+        row = cursor.fetchone()
+        return self._row(cursor, row) if row else None
+
+    def list(self, status="pending", page=1, per_page=50):
+        page = max(page, 1)
+        per_page = min(max(per_page, 1), MAX_PER_PAGE)
+        conn = self._connections.get()
+        total = conn.execute("SELECT COUNT(*) FROM pending_requests WHERE status = ?", (status,)).fetchone()[0]
+        cursor = conn.execute(
+            "SELECT * FROM pending_requests WHERE status = ? ORDER BY id LIMIT ? OFFSET ?",
+            (status, per_page, (page - 1) * per_page),
+        )
+        return {
+            "requests": [self._row(cursor, row) for row in cursor.fetchall()],
+            "total": total,
+            "page": page,
+            "per_page": per_page
+        }
+
+    def resolve(self, request_id, status, reviewer):
+        # Moves a pending request to approved/rejected; False if it was already handled
+        with self._connections.transaction() as conn:
+            updated = conn.execute(
+                "UPDATE pending_requests SET status = ?, reviewed_by = ?, reviewed_at = ? WHERE id = ? AND status = 'pending'",
+                (status, str(reviewer), datetime.utcnow().isoformat(), request_id),
+            ).rowcount
+        return updated == 1
@@ -0,0 +1,131 @@
+import os
+import re
+
+# Ban search for GET /blacklist/search: prefix and substring matches on the
+# Minecraft username, display name and reason of each ban.
+#
+# Field values are case-folded with whitespace collapsed. Queries of three or
+# more characters match anywhere in a field, found through a trigram index;
+# shorter ones match the start of a word, found through the one- and
+# two-character word prefixes indexed alongside ("^a", "^ab"). Candidates from
+# the index are always re-checked with match_score(), which also ranks them:
+# a whole-field match beats a field prefix, a word prefix and then any other
+# substring, weighted by field (usernames first, reasons last).
+
+SEARCH_FIELDS = (("minecraft_username", 3.0), ("display_name", 2.0), ("reason", 1.0))
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 20))
+SEARCH_MAX_PAGE_SIZE = 100
+# Ranked result lists kept per query until the next change, so paging through a
+# broad query ("che", a common reason) doesn't re-rank every match per page
+SEARCH_CACHE_SIZE = 64
+WORD = re.compile(r"\w+")
+
+
+def normalize(text):
+    return " ".join(str(text).casefold().split()) if text else ""
+
+
+def search_fields(details):
+    # {field: normalized text} for a ban entry
+    mc_info = details.get("mc_info") or {}
+    return {
+        "minecraft_username": normalize(mc_info.get("minecraft_username") or details.get("username")),
+        "display_name": normalize(details.get("display_name")),
+        "reason": normalize(details.get("reason")),
+    }
+
+
+def field_grams(fields):
+    grams = set()
+    for text in fields.values():
+        grams.update(text[i:i + 3] for i in range(len(text) - 2))
+        for word in WORD.findall(text):
+            grams.add("^" + word[:1])
+            grams.add("^" + word[:2])
+    return grams
+
+
+def query_grams(query):
+    if len(query) < 3:
+        return {"^" + query}
+    return {query[i:i + 3] for i in range(len(query) - 2)}
+
+
+def _match_kind(query, text):
+    if text == query:
+        return 4
+    if text.startswith(query):
+        return 3
+    start = text.find(query)
+    substring = start != -1
+    while start != -1:
+        if not text[start - 1].isalnum():
+            return 2
+        start = text.find(query, start + 1)
+    return 1 if substring and len(query) >= 3 else 0
+
+
+def match_score(query, fields):
+    # 0 when `query` (normalized) doesn't match
+    return sum(weight * _match_kind(query, fields[field]) for field, weight in SEARCH_FIELDS)
+
+
+def rank(matches):
+    # [(score, user_id)] -> best first, ties in user_id order so pages are stable
+    return sorted(matches, key=lambda match: (-match[0], match[1]))
+
+
+def remember(cache, key, value):
+    if len(cache) >= SEARCH_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+    cache[key] = value
+
+
+class SearchIndex:
+    # In-memory postings from each gram to the bans containing it, updated per
+    # ban and unban (BanStore keeps one per process once the first search needs it)
+
+    def __init__(self):
+        self._postings = {}
+        self._fields = {}
+        self._results = {}
+
+    def add(self, user_id, details):
+        self.remove(user_id)
+        self._results = {}
+        fields = search_fields(details)
+        self._fields[user_id] = fields
+        for gram in field_grams(fields):
+            self._postings.setdefault(gram, set()).add(user_id)
+
+    def remove(self, user_id):
+        fields = self._fields.pop(user_id, None)
+        if fields is None:
+            return
+        self._results = {}
+        for gram in field_grams(fields):
+            user_ids = self._postings[gram]
+            user_ids.discard(user_id)
+            if not user_ids:
+                del self._postings[gram]
+
+    def search(self, query):
+        # Ranked [(score, user_id)] of every match
+        query = normalize(query)
+        if not query:
+            return []
+        if query in self._results:
+            return self._results[query]
+        postings = [self._postings.get(gram) for gram in query_grams(query)]
+        if not all(postings):
+            return []
+        postings.sort(key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        matches = []
+        for user_id in candidates:
+            score = match_score(query, self._fields[user_id])
+            if score:
+                matches.append((score, user_id))
+        matches = rank(matches)
+        remember(self._results, query, matches)
+        return matches
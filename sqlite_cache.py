@@ -0,0 +1,125 @@
+import pickle
+import sqlite3
+import time
+from flask_caching.backends.base import BaseCache
+import metrics
+from storage_utils import SQLiteConnections
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)",
+    "CREATE TABLE IF NOT EXISTS cache_tags (tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key))",
+    "CREATE INDEX IF NOT EXISTS cache_tags_key ON cache_tags (key)",
+)
+# A hot key's access time is only rewritten this often, so reads stay mostly read-only
+ACCESS_RESOLUTION = 1.0
+# Sets between two size checks in one process
+EVICT_CHECK_EVERY = 64
+
+
+class SQLiteCache(BaseCache):
+    # flask_caching backend in a WAL-mode SQLite file, so all gunicorn workers
+    # (and the ASGI app) share hits and invalidations. Size is bounded by
+    # `threshold` entries with least-recently-used eviction. Entries can carry
+    # tags, and invalidate_tags() drops every entry with any of the given tags.
+    #
+    #   Cache(app, config={"CACHE_TYPE": "sqlite_cache.SQLiteCache", "CACHE_SQLITE_PATH": ...})
+
+    def __init__(self, path="data/cache/cache.db", default_timeout=300, threshold=10000):
+        super().__init__(default_timeout)
+        self.path = path
+        self.threshold = threshold
+        self._connections = SQLiteConnections(path, SCHEMA)
+        self._sets = 0
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(
+            path=config.get("CACHE_SQLITE_PATH", "data/cache/cache.db"),
+            threshold=config.get("CACHE_THRESHOLD", 10000),
+        )
+        return cls(*args, **kwargs)
+
+    def _expires(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.time() + timeout if timeout > 0 else 0
+
+    def get(self, key):
+        now = time.time()
+        try:
+            conn = self._connections.get()
+            row = conn.execute("SELECT value, expires, accessed FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[1] and row[1] <= now):
+                metrics.cache_result("shared", False)
+                return None
+            metrics.cache_result("shared", True)
+            value, expires, accessed = row
+            if accessed < now - ACCESS_RESOLUTION:
+                conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            return pickle.loads(value)
+        except (sqlite3.Error, pickle.PickleError):
+            return None
+
+    def has(self, key):
+        row = self._connections.get().execute(
+            "SELECT expires FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        return row is not None and (not row[0] or row[0] > time.time())
+
+    def set(self, key, value, timeout=None, tags=()):
+        now = time.time()
+        try:
+            with self._connections.transaction() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                    (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._expires(timeout), now),
+                )
+                conn.executemany("INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)",
+                                 [(tag, key) for tag in tags])
+        except sqlite3.Error:
+            return False
+        self._sets += 1
+        if self._sets % EVICT_CHECK_EVERY == 0:
+            self._evict()
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._connections.transaction() as conn:
+            deleted = conn.execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount
+            conn.execute("DELETE FROM cache_tags WHERE key = ?", (key,))
+        return deleted > 0
+
+    def clear(self):
+        with self._connections.transaction() as conn:
+            conn.execute("DELETE FROM cache")
+            conn.execute("DELETE FROM cache_tags")
+        return True
+
+    def invalidate_tags(self, *tags):
+        if not tags:
+            return 0
+        placeholders = ",".join("?" * len(tags))
+        with self._connections.transaction() as conn:
+            deleted = conn.execute(
+                f"DELETE FROM cache WHERE key IN (SELECT key FROM cache_tags WHERE tag IN ({placeholders}))", tags
+            ).rowcount
+            conn.execute(
+                f"DELETE FROM cache_tags WHERE key IN (SELECT key FROM cache_tags WHERE tag IN ({placeholders}))", tags
+            )
+        return deleted
+
+    def _evict(self):
+        with self._connections.transaction() as conn:
+            now = time.time()
+            conn.execute("DELETE FROM cache WHERE expires != 0 AND expires <= ?", (now,))
+            excess = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.threshold
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)", (excess,)
+                )
+            conn.execute("DELETE FROM cache_tags WHERE key NOT IN (SELECT key FROM cache)")
@@ -0,0 +1,143 @@
+import os
+import sqlite3
+import time
+from limits.storage import Storage, MovingWindowSupport
+import metrics
+from storage_utils import SQLiteConnections
+
+# Longest window any limit uses; moving-window buckets older than this can't
+# count against anything and are purged by purge_expired
+LIMITER_MAX_WINDOW = float(os.getenv("LIMITER_MAX_WINDOW", 86400))
+# The moving window keeps one count per key per 1/MOVING_WINDOW_BUCKETS of the
+# window instead of a row per hit, so a hit costs the same at 10 or 1,000,000
+# per day. Buckets partly inside the window count whole: a key can be refused
+# up to that fraction of its limit early, never let through late.
+MOVING_WINDOW_BUCKETS = int(os.getenv("MOVING_WINDOW_BUCKETS", 60))
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, count INTEGER NOT NULL, expiry REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS counters_expiry ON counters (expiry)",
+    # Moving-window counts per (key, bucket start time)
+    "CREATE TABLE IF NOT EXISTS window_buckets (key TEXT NOT NULL, start REAL NOT NULL, count INTEGER NOT NULL, "
+    "PRIMARY KEY (key, start)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS window_buckets_start ON window_buckets (start)",
+    # One row per hit, from before the buckets
+    "DROP TABLE IF EXISTS window_entries",
+)
+
+
+def _window(now, expiry):
+    # (bucket width, start of the bucket `now` falls in, start of the oldest bucket overlapping the window)
+    width = expiry / MOVING_WINDOW_BUCKETS
+    return width, (now // width) * width, ((now - expiry) // width) * width
+
+
+class SQLiteStorage(Storage, MovingWindowSupport):
+    # Rate limit storage shared by every gunicorn worker through one SQLite
+    # database in WAL mode. Each hit is a single indexed upsert inside an
+    # IMMEDIATE transaction, so increments are never lost between processes.
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, **options):
+        self.file_path = options.get("file_path", "data/rate_limits/limiter.db")
+        self._connections = SQLiteConnections(self.file_path, SCHEMA)
+        super().__init__(uri, **options)
+
+    @property
+    def base_exceptions(self):
+        return (sqlite3.Error,)
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        now = time.time()
+        with metrics.timer("limiter_storage_seconds", storage="sqlite", op="incr"), \
+                self._connections.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO counters (key, count, expiry) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    count = CASE WHEN counters.expiry <= ? THEN excluded.count
+                                 ELSE counters.count + excluded.count END,
+                    expiry = CASE WHEN counters.expiry <= ? OR ? THEN excluded.expiry
+                                  ELSE counters.expiry END
+                """,
+                (key, amount, now + expiry, now, now, bool(elastic_expiry)),
+            )
+            row = conn.execute("SELECT count FROM counters WHERE key = ?", (key,)).fetchone()
+        return row[0]
+
+    def get(self, key):
+        with metrics.timer("limiter_storage_seconds", storage="sqlite", op="get"):
+            row = self._connections.get().execute(
+                "SELECT count FROM counters WHERE key = ? AND expiry > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self._connections.get().execute(
+            "SELECT expiry FROM counters WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self):
+        try:
+            self._connections.get().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        with self._connections.transaction() as conn:
+            cleared = conn.execute("DELETE FROM counters").rowcount
+            cleared += conn.execute("DELETE FROM window_buckets").rowcount
+        return cleared
+
+    def clear(self, key):
+        with self._connections.transaction() as conn:
+            conn.execute("DELETE FROM counters WHERE key = ?", (key,))
+            conn.execute("DELETE FROM window_buckets WHERE key = ?", (key,))
+
+    def purge_expired(self, now=None):
+        # Deletes expired counters and window buckets of keys that stopped
+        # sending requests (acquire_entry only trims the key it is called for).
+        # Returns how many rows were deleted.
+        now = time.time() if now is None else now
+        with self._connections.transaction() as conn:
+            purged = conn.execute("DELETE FROM counters WHERE expiry <= ?", (now,)).rowcount
+            purged += conn.execute("DELETE FROM window_buckets WHERE start <= ?", (now - LIMITER_MAX_WINDOW,)).rowcount
+        return purged
+
+    # Moving window support
+
+    def acquire_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        _, current, oldest = _window(now, expiry)
+        with metrics.timer("limiter_storage_seconds", storage="sqlite", op="acquire_entry"), \
+                self._connections.transaction() as conn:
+            # Buckets that left the window can never count again; dropping them
+            # keeps each key at MOVING_WINDOW_BUCKETS + 1 rows at most
+            conn.execute("DELETE FROM window_buckets WHERE key = ? AND start < ?", (key, oldest))
+            count = conn.execute("SELECT COALESCE(SUM(count), 0) FROM window_buckets WHERE key = ?",
+                                 (key,)).fetchone()[0]
+            if count + amount > limit:
+                return False
+            conn.execute(
+                "INSERT INTO window_buckets (key, start, count) VALUES (?, ?, ?) "
+                "ON CONFLICT (key, start) DO UPDATE SET count = count + excluded.count",
+                (key, current, amount),
+            )
+        return True
+
+    def get_moving_window(self, key, limit, expiry):
+        now = time.time()
+        width, _, oldest = _window(now, expiry)
+        start, count = self._connections.get().execute(
+            "SELECT MIN(start), COALESCE(SUM(count), 0) FROM window_buckets WHERE key = ? AND start >= ?",
+            (key, oldest)
+        ).fetchone()
+        # The window frees up when its oldest bucket leaves it
+        return (start + width if start is not None else now, count)
+
+    def get_num_requests(self, key):
+        return self.get(key)
@@ -0,0 +1,458 @@
+import json
+import threading
+import time
+import metrics
+from api_key_store import API_KEY_CACHE_SIZE, API_KEY_CACHE_TTL, KeyIdentity, hash_record, key_digest, key_tier, parse_expiry
+from ban_store import BLOOM_FP_RATE, BLOOM_HEADROOM, BLOOM_MIN_CAPACITY, ban_expired, ban_expires_at
+from bloom import BloomFilter
+from identifiers import LOOKUP_FIELDS, canonical, entry_aliases, field_alias
+from search_index import SEARCH_FIELDS, SEARCH_PAGE_SIZE, match_score, normalize, rank, remember, search_fields
+from storage_utils import SQLiteConnections
+from ttl_cache import TTLCache
+
+# SQLite implementations of the ban and API key stores, for deployments that
+# have outgrown whole-file JSON. They expose the same methods as BanStore and
+# ApiKeyStore, so stores.py can pick either backend (STORAGE_BACKEND).
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS bans (
+        user_id TEXT PRIMARY KEY,
+        details TEXT NOT NULL,
+        updated_seq INTEGER NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS bans_updated_seq ON bans (updated_seq)",
+    # Canonical identifiers (identifiers.py) of each ban, in insertion order
+    "CREATE TABLE IF NOT EXISTS ban_aliases (alias TEXT NOT NULL, user_id TEXT NOT NULL, PRIMARY KEY (alias, user_id))",
+    "CREATE INDEX IF NOT EXISTS ban_aliases_user_id ON ban_aliases (user_id)",
+    # End of each time-limited ban, for expire()
+    "CREATE TABLE IF NOT EXISTS ban_expiry (user_id TEXT PRIMARY KEY, expires_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ban_expiry_expires_at ON ban_expiry (expires_at)",
+    # Normalized search fields (search_index.search_fields) of each ban, under its
+    # bans rowid, in a trigram full-text index
+    "CREATE VIRTUAL TABLE IF NOT EXISTS ban_search USING fts5("
+    "minecraft_username, display_name, reason, tokenize='trigram')",
+    # Keys are stored only as salted digests (api_key_store.key_digest)
+    """CREATE TABLE IF NOT EXISTS api_keys (
+        key_hash TEXT PRIMARY KEY,
+        prefix TEXT,
+        user_id TEXT NOT NULL,
+        created_at TEXT,
+        role_created INTEGER NOT NULL DEFAULT 0,
+        expiry TEXT,
+        expires_at REAL,
+        tier TEXT NOT NULL DEFAULT 'default'
+    )""",
+    "CREATE INDEX IF NOT EXISTS api_keys_user_id ON api_keys (user_id)",
+    "CREATE INDEX IF NOT EXISTS api_keys_expires_at ON api_keys (expires_at)",
+    "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value REAL NOT NULL)",
+    # Ban/unban events committed with the change they describe and not yet
+    # copied to the change feed, in commit order (see SQLiteBanStore._publish)
+    "CREATE TABLE IF NOT EXISTS change_outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "op TEXT NOT NULL, user_id TEXT NOT NULL, details TEXT)",
+)
+_MISSING = object()
+
+
+def _bump_version(conn):
+    conn.execute("INSERT INTO meta (name, value) VALUES ('version', 1) "
+                 "ON CONFLICT (name) DO UPDATE SET value = value + 1")
+    conn.execute("INSERT INTO meta (name, value) VALUES ('modified_at', ?) "
+                 "ON CONFLICT (name) DO UPDATE SET value = excluded.value", (time.time(),))
+    return int(conn.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()[0])
+
+
+def _index_search(conn, entries):
+    conn.executemany(
+        "INSERT INTO ban_search (rowid, minecraft_username, display_name, reason) "
+        "SELECT rowid, ?, ?, ? FROM bans WHERE user_id = ?",
+        [tuple(search_fields(details)[field] for field, _ in SEARCH_FIELDS) + (user_id,)
+         for user_id, details in entries],
+    )
+
+
+class SQLiteBanStore:
+    # Bans in a table keyed by Discord ID, plus an index table from every
+    # canonical alias to its ban, so any identifier form is a single index
+    # probe and a ban is one transaction. A `version` counter
+    # in the meta table changes with every mutation; each row remembers the
+    # version that wrote it, so a worker's Bloom filter only reads rows changed
+    # since it last looked. ban_search is kept in step with bans in the same
+    # transactions, for search(). So are the change events: each write queues
+    # them in change_outbox and then moves everything queued to the change
+    # feed, holding the feed's lock, so the feed sees changes in commit order
+    # and events queued before a crash go out with the next write.
+
+    def __init__(self, path, change_feed=None):
+        self.path = path
+        self.change_feed = change_feed
+        self._connections = SQLiteConnections(path, SCHEMA)
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self._snapshot_version = None
+        self._bloom = None
+        self._bloom_version = 0
+        self._bloom_capacity = 0
+        self._search_backfilled = False
+        self._search_results = {}
+        self._search_version = None
+
+    def _meta(self, name):
+        row = self._connections.get().execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def refresh(self):
+        pass
+
+    @property
+    def version(self):
+        return f"sqlite-{int(self._meta('version'))}"
+
+    @property
+    def last_modified(self):
+        return self._meta("modified_at")
+
+    def snapshot(self):
+        version = self._meta("version")
+        if version != self._snapshot_version:
+            with self._lock, metrics.timer("sqlite_io_seconds", table="bans", op="snapshot"):
+                rows = self._connections.get().execute("SELECT user_id, details FROM bans ORDER BY rowid")
+                self._snapshot = {user_id: json.loads(details) for user_id, details in rows}
+                self._snapshot_version = version
+        return self._snapshot
+
+    def iter_bans(self, chunk_size=1000):
+        # Streams (user_id, details) pairs a chunk at a time, in insertion order
+        last_rowid = 0
+        while True:
+            rows = self._connections.get().execute(
+                "SELECT rowid, user_id, details FROM bans WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, chunk_size),
+            ).fetchall()
+            for last_rowid, user_id, details in rows:
+                yield user_id, json.loads(details)
+            if len(rows) < chunk_size:
+                return
+
+    def get(self, user_id):
+        row = self._connections.get().execute("SELECT details FROM bans WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_by(self, field, identifier):
+        if field == "user_id":
+            return identifier if self.get(identifier) is not None else None
+        if field not in LOOKUP_FIELDS:
+            raise ValueError(f"Unknown field: {field}")
+        alias = canonical(identifier)
+        rows = self._connections.get().execute(
+            "SELECT b.user_id, b.details FROM ban_aliases a JOIN bans b USING (user_id) "
+            "WHERE a.alias = ? ORDER BY a.rowid", (alias,)
+        )
+        for user_id, details in rows:
+            if field_alias(json.loads(details), field) == alias:
+                return user_id
+        return None
+
+    def find(self, identifier):
+        # Same matching as BanStore.find
+        if self.get(identifier) is not None:
+            return identifier
+        row = self._connections.get().execute(
+            "SELECT user_id FROM ban_aliases WHERE alias = ? ORDER BY rowid LIMIT 1", (canonical(identifier),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def lookup(self, identifier):
+        # Same as BanStore.lookup; SQLite's own indexes already keep the list
+        # out of process memory, so there is no separate compiled index
+        if not self.might_contain(identifier):
+            return None
+        return self.find_many([identifier]).get(identifier)
+
+    def ensure_index(self):
+        pass
+
+    def find_many(self, identifiers):
+        conn = self._connections.get()
+        matches = {}
+        # One read transaction, so every identifier sees the same data
+        conn.execute("BEGIN")
+        try:
+            for identifier in identifiers:
+                user_id = self.find(identifier)
+                if user_id is not None:
+                    details = self.get(user_id)
+                    if not ban_expired(details):
+                        matches[identifier] = (user_id, details)
+        finally:
+            conn.execute("COMMIT")
+        return matches
+
+    def _refresh_bloom(self):
+        version = int(self._meta("version"))
+        if self._bloom is not None and version == self._bloom_version:
+            return
+        with self._lock:
+            conn = self._connections.get()
+            if self._bloom is None or self._bloom.count > self._bloom_capacity:
+                count = conn.execute("SELECT COUNT(*) FROM ban_aliases").fetchone()[0]
+                self._bloom_capacity = max(int(count * BLOOM_HEADROOM), BLOOM_MIN_CAPACITY)
+                self._bloom = BloomFilter.for_capacity(self._bloom_capacity, BLOOM_FP_RATE)
+                since = 0
+            else:
+                since = self._bloom_version
+            rows = conn.execute(
+                "SELECT a.alias FROM ban_aliases a JOIN bans b USING (user_id) WHERE b.updated_seq > ?", (since,)
+            )
+            for (alias,) in rows:
+                self._bloom.add(alias)
+            self._bloom_version = version
+
+    def might_contain(self, identifier):
+        self._refresh_bloom()
+        return canonical(identifier) in self._bloom
+
+    def bloom_filter(self):
+        self._refresh_bloom()
+        return self._bloom
+
+    def _backfill_search(self):
+        # Bans written before ban_search existed
+        if self._search_backfilled:
+            return
+        with self._connections.transaction() as conn:
+            rows = conn.execute(
+                "SELECT user_id, details FROM bans WHERE rowid NOT IN (SELECT rowid FROM ban_search)"
+            ).fetchall()
+            _index_search(conn, [(user_id, json.loads(details)) for user_id, details in rows])
+        self._search_backfilled = True
+
+    def search(self, query, offset=0, limit=SEARCH_PAGE_SIZE):
+        # Same matching and ranking as BanStore.search. FTS5's trigram index
+        # finds candidates for queries of 3+ characters; shorter ones (word
+        # prefixes) are too short for trigrams and scan the table with LIKE.
+        query = normalize(query)
+        if not query:
+            return 0, []
+        self._backfill_search()
+        version = self._meta("version")
+        if version != self._search_version:
+            self._search_results = {}
+            self._search_version = version
+        matches = self._search_results.get(query)
+        if matches is None:
+            matches = self._search_matches(query)
+            remember(self._search_results, query, matches)
+        page = [(user_id, self.get(user_id), score) for score, user_id in matches[offset:offset + limit]]
+        page = [match for match in page if match[1] is not None]  # Unbanned since
+        return len(matches), page
+
+    def _search_matches(self, query):
+        if len(query) >= 3:
+            where, params = "ban_search MATCH ?", ('"' + query.replace('"', '""') + '"',)
+        else:
+            pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            where = " OR ".join(f"s.{field} LIKE ? ESCAPE '\\'" for field, _ in SEARCH_FIELDS)
+            params = (pattern,) * len(SEARCH_FIELDS)
+        rows = self._connections.get().execute(
+            "SELECT b.user_id, s.minecraft_username, s.display_name, s.reason "
+            f"FROM ban_search s JOIN bans b ON b.rowid = s.rowid WHERE {where}", params
+        )
+        matches = []
+        for user_id, *values in rows:
+            score = match_score(query, dict(zip((field for field, _ in SEARCH_FIELDS), values)))
+            if score:
+                matches.append((score, user_id))
+        return rank(matches)
+
+    def ban_many(self, entries):
+        # entries: iterable of (user_id, details), written in one transaction;
+        # a user_id given twice keeps its last details
+        entries = list(dict(entries).items())
+        if not entries:
+            return
+        with self._connections.transaction() as conn:
+            version = _bump_version(conn)
+            conn.executemany(
+                "INSERT INTO bans (user_id, details, updated_seq) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET details = excluded.details, updated_seq = excluded.updated_seq",
+                [(user_id, json.dumps(details), version) for user_id, details in entries],
+            )
+            conn.executemany("DELETE FROM ban_aliases WHERE user_id = ?", [(user_id,) for user_id, _ in entries])
+            conn.executemany(
+                "INSERT OR IGNORE INTO ban_aliases (alias, user_id) VALUES (?, ?)",
+                [(alias, user_id) for user_id, details in entries for alias in entry_aliases(user_id, details)],
+            )
+            conn.executemany("DELETE FROM ban_search WHERE rowid = (SELECT rowid FROM bans WHERE user_id = ?)",
+                             [(user_id,) for user_id, _ in entries])
+            _index_search(conn, entries)
+            conn.executemany("DELETE FROM ban_expiry WHERE user_id = ?", [(user_id,) for user_id, _ in entries])
+            conn.executemany(
+                "INSERT INTO ban_expiry (user_id, expires_at) VALUES (?, ?)",
+                [(user_id, ban_expires_at(details)) for user_id, details in entries
+                 if ban_expires_at(details) is not None],
+            )
+            self._queue_changes(conn, [("ban", user_id, details) for user_id, details in entries])
+        self._publish()
+
+    def ban(self, user_id, details):
+        self.ban_many([(user_id, details)])
+
+    def unban(self, user_id):
+        with self._connections.transaction() as conn:
+            conn.execute("DELETE FROM ban_search WHERE rowid = (SELECT rowid FROM bans WHERE user_id = ?)", (user_id,))
+            if conn.execute("DELETE FROM bans WHERE user_id = ?", (user_id,)).rowcount == 0:
+                return False
+            conn.execute("DELETE FROM ban_aliases WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM ban_expiry WHERE user_id = ?", (user_id,))
+            _bump_version(conn)
+            self._queue_changes(conn, [("unban", user_id, None)])
+        self._publish()
+        return True
+
+    def next_expiry(self):
+        return self._connections.get().execute("SELECT MIN(expires_at) FROM ban_expiry").fetchone()[0]
+
+    def expire(self, now=None):
+        # Deletes every ban whose expires_at has passed in one transaction and
+        # publishes them as unbans; returns their user_ids
+        now = time.time() if now is None else now
+        with self._connections.transaction() as conn:
+            user_ids = [row[0] for row in conn.execute(
+                "SELECT user_id FROM ban_expiry WHERE expires_at <= ?", (now,))]
+            if not user_ids:
+                return []
+            params = [(user_id,) for user_id in user_ids]
+            conn.executemany("DELETE FROM ban_search WHERE rowid = (SELECT rowid FROM bans WHERE user_id = ?)", params)
+            conn.executemany("DELETE FROM bans WHERE user_id = ?", params)
+            conn.executemany("DELETE FROM ban_aliases WHERE user_id = ?", params)
+            conn.executemany("DELETE FROM ban_expiry WHERE user_id = ?", params)
+            _bump_version(conn)
+            self._queue_changes(conn, [("unban", user_id, None) for user_id in user_ids])
+        self._publish()
+        return user_ids
+
+    def _queue_changes(self, conn, changes):
+        # changes: (op, user_id, details), inside the transaction making them
+        if self.change_feed is not None:
+            conn.executemany(
+                "INSERT INTO change_outbox (op, user_id, details) VALUES (?, ?, ?)",
+                [(op, user_id, None if details is None else json.dumps(details)) for op, user_id, details in changes],
+            )
+
+    def _publish(self):
+        # Moves queued changes to the feed. Whichever worker gets the feed's
+        # lock first publishes every committed change, its own and others',
+        # oldest first. A crash between the append and the delete publishes
+        # some again, which consumers applying bans and unbans don't notice.
+        if self.change_feed is None:
+            return
+        with self.change_feed.exclusive():
+            rows = self._connections.get().execute(
+                "SELECT id, op, user_id, details FROM change_outbox ORDER BY id").fetchall()
+            if not rows:
+                return
+            self.change_feed.append_many([(op, user_id, None if details is None else json.loads(details))
+                                          for _, op, user_id, details in rows])
+            with self._connections.transaction() as conn:
+                conn.execute("DELETE FROM change_outbox WHERE id <= ?", (rows[-1][0],))
+
+
+class SQLiteApiKeyStore:
+    # API keys indexed by key digest and by user_id. Validation results are
+    # cached per process for at most API_KEY_CACHE_TTL seconds (and never past a
+    # key's expiry), which bounds how long a revoked key keeps working.
+
+    def __init__(self, path, ttl=API_KEY_CACHE_TTL, maxsize=API_KEY_CACHE_SIZE):
+        self.path = path
+        self._connections = SQLiteConnections(path, SCHEMA)
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def refresh(self, force=False):
+        if force:
+            self._cache.clear()
+
+    def invalidate(self):
+        self._cache.clear()
+
+    def identify(self, api_key):
+        if not api_key:
+            return None
+        digest = key_digest(api_key)
+        cached = self._cache.get(digest, _MISSING)
+        metrics.cache_result("api_keys", cached is not _MISSING)
+        if cached is not _MISSING:
+            return cached
+        row = self._connections.get().execute(
+            "SELECT user_id, expires_at, tier FROM api_keys WHERE key_hash = ?", (digest,)
+        ).fetchone()
+        user_id, expires_at, tier = row if row else (None, None, None)
+        if user_id is None or (expires_at is not None and expires_at <= time.time()):
+            self._cache.set(digest, None)
+            return None
+        identity = KeyIdentity(user_id, tier, digest[:16])
+        self._cache.set(digest, identity, expires_at=expires_at)
+        return identity
+
+    def lookup(self, api_key):
+        identity = self.identify(api_key)
+        return identity.user_id if identity else None
+
+    @staticmethod
+    def _record(row):
+        key_hash, prefix, user_id, created_at, role_created, expiry, tier = row
+        return {"key_hash": key_hash, "prefix": prefix, "user_id": user_id, "created_at": created_at,
+                "role_created": bool(role_created), "expiry": expiry, "tier": tier}
+
+    def all_keys(self):
+        rows = self._connections.get().execute(
+            "SELECT key_hash, prefix, user_id, created_at, role_created, expiry, tier FROM api_keys ORDER BY rowid"
+        )
+        return [self._record(row) for row in rows]
+
+    def keys_for_user(self, user_id):
+        rows = self._connections.get().execute(
+            "SELECT key_hash, prefix, user_id, created_at, role_created, expiry, tier FROM api_keys "
+            "WHERE user_id = ? ORDER BY rowid", (user_id,),
+        )
+        return [self._record(row) for row in rows]
+
+    def add_keys(self, records, unique_user=False):
+        # Raw keys are hashed here and never written; hashed records pass
+        # through. With unique_user nothing is written (and False returned) if
+        # any of the users already has a key, checked in the write transaction.
+        rows = []
+        for record in map(hash_record, records):
+            try:
+                expires_at = parse_expiry(record.get("expiry"))
+            except ValueError:
+                expires_at = 0.0  # Unparseable expiry: treat as expired, like the JSON store
+            rows.append((record["key_hash"], record.get("prefix"), str(record["user_id"]), record.get("created_at"),
+                         int(bool(record.get("role_created"))), record.get("expiry"), expires_at, key_tier(record)))
+        with self._connections.transaction() as conn:
+            if unique_user and any(conn.execute("SELECT 1 FROM api_keys WHERE user_id = ?", (row[2],)).fetchone()
+                                   for row in rows):
+                return False
+            conn.executemany(
+                "INSERT OR REPLACE INTO api_keys "
+                "(key_hash, prefix, user_id, created_at, role_created, expiry, expires_at, tier) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows,
+            )
+        self.invalidate()
+        return True
+
+    def add_key(self, record, unique_user=False):
+        return self.add_keys([record], unique_user)
+
+    def next_expiry(self):
+        return self._connections.get().execute(
+            "SELECT MIN(expires_at) FROM api_keys WHERE expires_at > 0").fetchone()[0]
+
+    def purge_expired(self, now=None):
+        # Deletes keys past their expiry; unparseable ones (expires_at 0) are
+        # left for someone to fix. Returns how many were deleted.
+        now = time.time() if now is None else now
+        with self._connections.transaction() as conn:
+            purged = conn.execute("DELETE FROM api_keys WHERE expires_at > 0 AND expires_at <= ?", (now,)).rowcount
+        if purged:
+            self.invalidate()
+        return purged
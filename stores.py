@@ -0,0 +1,59 @@
+import os
+from ban_store import BanStore
+from change_feed import ChangeFeed
+from api_key_store import ApiKeyStore
+from ban_views import BlacklistView
+from pending_queue import PendingQueue
+
+# Data files and the per-process stores over them, shared by the Flask app
+# (api.py) and the ASGI app (asgi.py)
+BANNED_USERS_FILE = "data/banned_users.json"
+# Compiled copy of the ban list that workers mmap for lookups (ban_index.py)
+BAN_INDEX_FILE = "data/banned_users.idx"
+API_KEYS_FILE = "data/api_keys.json"
+CHANGES_FILE = "data/blacklist_changes.jsonl"
+PENDING_REQUESTS_FILE = "data/pending_requests.db"
+# Bans and API keys live either in the JSON files above ("json") or in one
+# SQLite database ("sqlite"); migrate_json.py copies the former into the latter
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+DATABASE_FILE = os.getenv("DATABASE_FILE", "data/idotheapi.db")
+# Rate limit counters: SQLite is safe across the gunicorn workers and supports
+# the moving-window strategy; "file" keeps the old JSON file
+RATE_LIMIT_STORAGE = os.getenv("RATE_LIMIT_STORAGE", "sqlite")
+RATE_LIMIT_FILES = {
+    "sqlite": "data/rate_limits/limiter.db",
+    "file": "data/rate_limits/limiter.json"
+}
+# limits strategy name; only SQLite has an efficient moving window
+RATE_LIMIT_STRATEGY = os.getenv("RATE_LIMIT_STRATEGY", "moving-window" if RATE_LIMIT_STORAGE == "sqlite" else "fixed-window")
+
+# Numbered ban/unban events for consumers mirroring the list
+change_feed = ChangeFeed(CHANGES_FILE)
+if STORAGE_BACKEND == "sqlite":
+    from sqlite_store import SQLiteApiKeyStore, SQLiteBanStore
+    ban_store = SQLiteBanStore(DATABASE_FILE, change_feed=change_feed)
+    api_key_store = SQLiteApiKeyStore(DATABASE_FILE)
+elif STORAGE_BACKEND == "json":
+    # Indexed, mtime-reloaded view of BANNED_USERS_FILE
+    ban_store = BanStore(BANNED_USERS_FILE, change_feed=change_feed, index_path=BAN_INDEX_FILE)
+    # Digest-indexed, cached view of API_KEYS_FILE used to authenticate requests
+    api_key_store = ApiKeyStore(API_KEYS_FILE)
+else:
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+# view_blacklist rows, rebuilt once per ban data version
+blacklist_view = BlacklistView(ban_store)
+# Website blacklist submissions awaiting review, shared by all workers
+pending_queue = PendingQueue(PENDING_REQUESTS_FILE)
+
+
+def open_limiter_storage():
+    # A handle on the rate limit storage the Flask limiter uses, for the ASGI
+    # app's limiter and the expiry sweeper; None for schemes not defined here
+    file_path = RATE_LIMIT_FILES.get(RATE_LIMIT_STORAGE)
+    if RATE_LIMIT_STORAGE == "sqlite":
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage("sqlite://", file_path=file_path)
+    if RATE_LIMIT_STORAGE == "file":
+        from file_storage import FileStorage
+        return FileStorage("file://", file_path=file_path)
+    return None
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# The modules live at the repository root and the upstream stub in benchmarks/;
+# metrics go to a scratch directory instead of data/metrics
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+sys.path.insert(0, REPO_DIR)
+os.environ.setdefault("METRICS_DIR", tempfile.mkdtemp(prefix="idotheapi-metrics-"))
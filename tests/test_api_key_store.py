@@ -0,0 +1,87 @@
+import json
+import pytest
+
+import api_key_store
+from api_key_store import ApiKeyStore, key_digest
+from sqlite_store import SQLiteApiKeyStore
+
+
+@pytest.fixture(autouse=True)
+def salt(monkeypatch):
+    monkeypatch.setenv("API_KEY_SALT", "test-salt")
+    monkeypatch.setattr(api_key_store, "_salt", None)
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "json":
+        return ApiKeyStore(str(tmp_path / "api_keys.json"))
+    return SQLiteApiKeyStore(str(tmp_path / "idotheapi.db"))
+
+
+def key_record(key, user_id="1", **fields):
+    return dict({"key": key, "user_id": user_id, "created_at": "2024-01-01T00:00:00", "role_created": False,
+                 "expiry": None}, **fields)
+
+
+def test_identify_checks_the_key_hash(store):
+    store.add_key(key_record("secret-key-1", tier="role"))
+    identity = store.identify("secret-key-1")
+    assert identity.user_id == "1"
+    assert identity.tier == "role"
+    assert identity.key_id == key_digest("secret-key-1")[:16]
+    assert store.identify("secret-key-2") is None
+    assert store.identify("") is None
+
+
+def test_raw_keys_are_never_stored(store):
+    store.add_key(key_record("secret-key-1"))
+    [record] = store.all_keys()
+    assert "key" not in record
+    assert record["key_hash"] == key_digest("secret-key-1")
+    assert record["prefix"] == "secret-k"
+
+
+def test_expired_keys_do_not_identify(store):
+    store.add_key(key_record("old-key", expiry="2000-01-01T00:00:00"))
+    assert store.identify("old-key") is None
+    assert store.purge_expired() == 1
+    assert store.all_keys() == []
+
+
+def test_unique_user_refuses_a_second_key(store):
+    assert store.add_key(key_record("first-key"), unique_user=True)
+    assert not store.add_key(key_record("second-key"), unique_user=True)
+    assert store.identify("second-key") is None
+    assert [record["prefix"] for record in store.keys_for_user("1")] == ["first-ke"]
+
+
+def test_plaintext_keys_are_hashed_on_load_and_migrate(tmp_path):
+    path = tmp_path / "api_keys.json"
+    path.write_text(json.dumps({"keys": [key_record("plain-key-1"), key_record("plain-key-2", user_id="2")]}))
+    store = ApiKeyStore(str(path))
+    assert store.lookup("plain-key-1") == "1"
+    assert store.lookup("plain-key-2") == "2"
+
+    assert store.migrate() == 2
+    text = path.read_text()
+    assert "plain-key" not in text
+    assert set(json.loads(text)["keys"]) == {key_digest("plain-key-1"), key_digest("plain-key-2")}
+    assert ApiKeyStore(str(path)).lookup("plain-key-1") == "1"
+
+
+def test_salt_file_is_created_once(tmp_path, monkeypatch):
+    monkeypatch.delenv("API_KEY_SALT")
+    monkeypatch.setattr(api_key_store, "API_KEY_SALT_FILE", str(tmp_path / "salt" / "api_key_salt"))
+    salt = api_key_store._load_salt()
+    assert salt and api_key_store._load_salt() == salt
+    assert sorted(p.name for p in (tmp_path / "salt").iterdir()) == ["api_key_salt"]
+
+
+def test_empty_salt_file_is_an_error(tmp_path, monkeypatch):
+    monkeypatch.delenv("API_KEY_SALT")
+    salt_file = tmp_path / "api_key_salt"
+    salt_file.write_text("")
+    monkeypatch.setattr(api_key_store, "API_KEY_SALT_FILE", str(salt_file))
+    with pytest.raises(RuntimeError):
+        api_key_store._load_salt()
@@ -0,0 +1,105 @@
+import json
+import pytest
+
+from ban_store import BanStore
+
+
+def ban_details(username, uuid=None, reason="cheating"):
+    mc_info = {"minecraft_username": username}
+    if uuid:
+        mc_info["minecraft_uuid"] = uuid
+    return {"reason": reason, "display_name": username, "mc_info": mc_info}
+
+
+UUID_A = "069a79f4-44e9-4726-a5be-fca90e38aaf5"
+UUID_B = "853c80ef-3c37-49fd-aa49-938b674adae6"
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "banned_users.json"), str(tmp_path / "banned_users.idx")
+
+
+def test_journal_replays_over_the_compacted_snapshot(paths):
+    path, _ = paths
+    store = BanStore(path, compact_every=0)
+    store.ban("100000000000000001", ban_details("Alpha", UUID_A))
+    store.ban("100000000000000002", ban_details("Bravo"))
+    store.compact()
+    with open(f"{path}.journal") as f:
+        assert f.read() == ""
+    store.ban("100000000000000003", ban_details("Charlie", UUID_B))
+    store.unban("100000000000000001")
+
+    reopened = BanStore(path, compact_every=0)
+    assert set(reopened.snapshot()) == {"100000000000000002", "100000000000000003"}
+    assert reopened.lookup("charlie")[0] == "100000000000000003"
+    assert reopened.lookup(UUID_B.replace("-", ""))[0] == "100000000000000003"
+    assert reopened.lookup("Alpha") is None
+    with open(path) as f:
+        assert set(json.load(f)) == {"100000000000000001", "100000000000000002"}
+
+
+def test_compaction_runs_every_compact_every_appends(paths):
+    path, _ = paths
+    store = BanStore(path, compact_every=3)
+    for i in range(3):
+        store.ban(f"10000000000000000{i}", ban_details(f"Player{i}"))
+    with open(f"{path}.journal") as f:
+        assert f.read() == ""
+    assert len(BanStore(path).snapshot()) == 3
+
+
+def test_torn_journal_tail_is_ignored_and_cut_off(paths):
+    path, _ = paths
+    store = BanStore(path, compact_every=0)
+    store.ban("100000000000000001", ban_details("Alpha"))
+    with open(f"{path}.journal", "a") as f:
+        f.write('{"op": "ban", "user_id": "1000')
+    assert set(BanStore(path).snapshot()) == {"100000000000000001"}
+    store.ban("100000000000000002", ban_details("Bravo"))
+    assert set(BanStore(path).snapshot()) == {"100000000000000001", "100000000000000002"}
+
+
+def test_index_lookups_agree_with_the_list(paths):
+    path, index_path = paths
+    writer = BanStore(path, compact_every=4, index_path=index_path)
+    reader = BanStore(path, compact_every=4, index_path=index_path)
+    in_memory = BanStore(path, compact_every=4)
+    queries = ["100000000000000001", "100000000000000002", "100000000000000003", "alpha", "BRAVO",
+               "Charlie", UUID_A, UUID_A.replace("-", ""), UUID_B, "nobody"]
+
+    def check():
+        for query in queries:
+            assert reader.lookup(query) == in_memory.lookup(query), query
+        assert reader.find_many(queries) == in_memory.find_many(queries)
+        assert reader.find_by("minecraft_uuid", UUID_B) == in_memory.find_by("minecraft_uuid", UUID_B)
+
+    writer.ban("100000000000000001", ban_details("Alpha", UUID_A))
+    assert writer.ensure_index()
+    check()
+    # Past the index: answered from the journal on top of it
+    writer.ban("100000000000000002", ban_details("Bravo", UUID_B))
+    writer.ban("100000000000000003", ban_details("Alpha", reason="alt account"))
+    check()
+    writer.unban("100000000000000001")
+    check()
+    assert reader.lookup("alpha")[0] == "100000000000000003"
+    # The fourth append compacts, which rebuilds the index
+    writer.ban("100000000000000001", ban_details("Charlie", UUID_A))
+    check()
+    writer.unban("100000000000000002")
+    check()
+    assert reader.lookup(UUID_B) is None
+    assert not reader._loaded
+
+
+def test_expired_bans_stop_matching(paths):
+    path, index_path = paths
+    store = BanStore(path, compact_every=0, index_path=index_path)
+    details = dict(ban_details("Alpha"), expires_at="2000-01-01T00:00:00")
+    store.ban("100000000000000001", details)
+    store.ban("100000000000000002", ban_details("Bravo"))
+    assert store.lookup("alpha") is None
+    assert store.expire() == ["100000000000000001"]
+    assert set(store.snapshot()) == {"100000000000000002"}
@@ -0,0 +1,90 @@
+import time
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("aiohttp")
+
+import mojang
+from stub_upstream import fake_uuid, serve
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**options):
+        server = serve(**options)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def resolver_for(server, **options):
+    return mojang.MojangResolver(f"http://127.0.0.1:{server.server_address[1]}", **options)
+
+
+def hits(server):
+    return server.RequestHandlerClass.hits
+
+
+def test_get_uuid_found_is_cached(stub):
+    server = stub()
+    resolver = resolver_for(server)
+    assert resolver.get_uuid("Notch") == fake_uuid("Notch")
+    assert resolver.get_uuid("notch") == fake_uuid("Notch")
+    assert hits(server) == 1
+
+
+@pytest.mark.parametrize("username", ["unknown_player", "missing_player"])  # 204 and 404
+def test_get_uuid_unknown_is_cached_briefly(stub, username):
+    server = stub()
+    resolver = resolver_for(server, negative_ttl=0.2)
+    assert resolver.get_uuid(username) is None
+    assert resolver.get_uuid(username) is None
+    assert hits(server) == 1
+    time.sleep(0.25)
+    assert resolver.get_uuid(username) is None
+    assert hits(server) == 2
+
+
+def test_get_uuid_timeout_is_not_cached(stub):
+    server = stub(delay=0.5)
+    resolver = resolver_for(server, timeout=(1.0, 0.1))
+    started = time.perf_counter()
+    assert resolver.get_uuid("Notch") is None
+    assert time.perf_counter() - started < 0.5
+    assert resolver.get_uuid("Notch") is None
+    assert hits(server) == 2
+
+
+def test_get_uuid_error_status_is_not_cached(stub):
+    server = stub(fail_status=500)
+    resolver = resolver_for(server)
+    assert resolver.get_uuid("Notch") is None
+    assert resolver.get_uuid("Notch") is None
+    assert hits(server) == 2
+
+
+def test_get_uuids_batches_and_caches(stub):
+    server = stub()
+    resolver = resolver_for(server)
+    names = [f"player{i}" for i in range(23)] + ["unknown_one", "player0"]
+    results = resolver.get_uuids(names)
+    # 24 distinct names, at most MOJANG_BATCH_SIZE per request
+    assert hits(server) == 3
+    assert results == {**{f"player{i}": fake_uuid(f"player{i}") for i in range(23)}, "unknown_one": None}
+    assert resolver.get_uuids(names) == results
+    assert resolver.get_uuid("player5") == fake_uuid("player5")
+    assert hits(server) == 3
+
+
+def test_get_uuids_leaves_out_failed_lookups(stub):
+    server = stub(fail_status=429)
+    resolver = resolver_for(server)
+    assert resolver.get_uuids(["Notch", "unknown_one"]) == {}
+    assert resolver.get_uuids(["Notch"]) == {}
+    assert hits(server) == 2
@@ -0,0 +1,60 @@
+import types
+import pytest
+
+pytest.importorskip("limits")
+
+from limits import parse
+from limits.strategies import FixedWindowRateLimiter, MovingWindowRateLimiter
+import sqlite_storage
+from sqlite_storage import SQLiteStorage
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(sqlite_storage, "time", types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return SQLiteStorage("sqlite://", file_path=str(tmp_path / "limiter.db"))
+
+
+@pytest.mark.parametrize("strategy", [FixedWindowRateLimiter, MovingWindowRateLimiter])
+def test_window_resets(storage, clock, strategy):
+    limiter = strategy(storage)
+    limit = parse("2 per minute")
+    assert limiter.hit(limit, "key")
+    assert limiter.hit(limit, "key")
+    assert not limiter.hit(limit, "key")
+    assert limiter.hit(limit, "other key")
+    clock[0] += 61
+    assert limiter.hit(limit, "key")
+
+
+def test_moving_window_frees_up_gradually(storage, clock):
+    limiter = MovingWindowRateLimiter(storage)
+    limit = parse("2 per minute")
+    assert limiter.hit(limit, "key")
+    clock[0] += 30
+    assert limiter.hit(limit, "key")
+    clock[0] += 31
+    # The first hit has left the window, the second hasn't
+    assert limiter.hit(limit, "key")
+    assert not limiter.hit(limit, "key")
+
+
+def test_cost_counts_against_the_limit(storage, clock):
+    limiter = MovingWindowRateLimiter(storage)
+    limit = parse("5 per minute")
+    assert limiter.hit(limit, "key", cost=4)
+    assert not limiter.hit(limit, "key", cost=2)
+    assert limiter.hit(limit, "key")
+
+
+def test_purge_expired_drops_idle_keys(storage, clock):
+    FixedWindowRateLimiter(storage).hit(parse("2 per minute"), "fixed")
+    MovingWindowRateLimiter(storage).hit(parse("2 per minute"), "moving")
+    assert storage.purge_expired(clock[0]) == 0
+    assert storage.purge_expired(clock[0] + sqlite_storage.LIMITER_MAX_WINDOW + 61) == 2
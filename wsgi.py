@@ -1,6 +1,8 @@
 import logging
 from logging.handlers import RotatingFileHandler
-from api import app
+from api import create_app
+
+app = create_app()
 
 # Configure logging
 def setup_logging():